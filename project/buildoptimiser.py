@@ -0,0 +1,241 @@
+import heapq
+import os
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+
+from RotMGCalc.project.calculator import dps
+from RotMGCalc.project.enchantmentmasks import EnchantmentMasks
+
+"""
+Build optimiser - finds the enchantments which give the most DPS for a loadout
+
+Each item has 0-4 enchantment slots, and each enchantment limits what it can sit next to (IncompatibleWithEnchantment
+Labels) and what it can go on (CompatibleWithItemLabels ...). Trying every combination on every item in one process
+takes minutes, so the search is split in three
+
+	1. per item, every valid set of enchantments is listed once (an "option"), only enchantments which change ATT or
+	DEX are considered, anything else can't change DPS and is the same as leaving the slot empty. the compatibility
+	rules are checked against precomputed EnchantmentMasks as the sets are built. options giving the
+	same ATT / DEX are merged and ones beaten on both stats by N others are dropped
+	2. branch and bound over the items - the best case for the items not picked yet is the largest ATT and the largest
+	DEX any of their options give, DPS only goes up with either stat so if that best case can't beat the current
+	top N the whole branch is dropped. the options of the last item are scored in one vectorised call
+	3. the options of the first item are shared out over a ProcessPoolExecutor, each worker keeps its own top N and
+	the results are merged at the end
+"""
+
+STAT_ATTACK = "Attack"
+STAT_DEXTERITY = "Dexterity"
+
+
+class Build:
+	__slots__ = ("dps", "attack", "dexterity", "enchantments")
+
+	def __init__(self, dps, attack, dexterity, enchantments):
+		self.dps = dps
+		self.attack = attack
+		self.dexterity = dexterity
+		# one tuple of enchantment records per loadout item
+		self.enchantments = enchantments
+
+	def __repr__(self):
+		return f"Build(dps={self.dps:.1f}, attack={self.attack:g}, dexterity={self.dexterity:g})"
+
+
+def statGains(enchantment):
+	# (attack, dexterity) an enchantment adds while equipped
+	attack = dexterity = 0.0
+	for stat, amount in enchantment.statBonuses:
+		if stat == STAT_ATTACK:
+			attack += amount
+		elif stat == STAT_DEXTERITY:
+			dexterity += amount
+	return attack, dexterity
+
+
+def enchantmentOptions(item, masks, slots=4):
+	"""
+	every valid set of up to `slots` enchantments for an item that changes ATT or DEX, including the empty set
+
+	:arg	masks: EnchantmentMasks of the enchantments to choose from
+
+	:returns: list of (attack, dexterity, enchantment tuple)
+	"""
+	candidates = [
+		index for index, enchantment in enumerate(masks.enchantments)
+		if any(statGains(enchantment)) and masks.compatibleWithItem(index, item)
+	]
+	gains = [statGains(masks.enchantments[index]) for index in candidates]
+	options = []
+
+	def extend(start, chosen, labels, exclusions, attack, dexterity):
+		options.append((attack, dexterity, tuple(masks.enchantments[index] for index in chosen)))
+		if len(chosen) == slots:
+			return
+		for position in range(start, len(candidates)):
+			index = candidates[position]
+			if masks.canAdd(index, labels, exclusions):
+				extend(position + 1, chosen + (index,), labels | masks.labels[index],
+				       exclusions | masks.incompatibleLabels[index], attack + gains[position][0],
+				       dexterity + gains[position][1])
+
+	extend(0, (), 0, 0, 0.0, 0.0)
+	return options
+
+
+def distinctOptions(options, top_n):
+	"""
+	cuts an item's options down to the ones worth searching
+
+	options with the same ATT / DEX gain can't be told apart by DPS, only the one using the fewest slots is kept so
+	the rest are free for enchantments which don't affect DPS. an option which at least top_n others match or beat on
+	both ATT and DEX can never be part of a top N build (swapping in any of those is at least as good) so it is dropped
+	"""
+	fewest = {}
+	for option in options:
+		key = (option[0], option[1])
+		if key not in fewest or len(option[2]) < len(fewest[key][2]):
+			fewest[key] = option
+
+	kept = list(fewest.values())
+	attack = np.array([option[0] for option in kept])
+	dexterity = np.array([option[1] for option in kept])
+	dominatedBy = ((attack[None, :] >= attack[:, None]) & (dexterity[None, :] >= dexterity[:, None])).sum(axis=1) - 1
+	return [option for option, count in zip(kept, dominatedBy) if count < top_n]
+
+
+class BuildSearch:
+	"""
+	the branch and bound search, this is what gets sent to each worker so it only holds plain data
+
+	options are stored per item as parallel arrays (attack gain, dexterity gain), the enchantment records stay with
+	optimiseBuild and are matched back up by option index once the search is done
+	"""
+
+	def __init__(self, weapon, options, base_attack, base_dexterity, defense, top_n, modifiers):
+		self.weapon = (weapon.minDamage, weapon.maxDamage, weapon.numProjectiles, weapon.rateOfFire,
+		               weapon.armorPiercing)
+		self.attack = [np.array([option[0] for option in itemOptions]) for itemOptions in options]
+		self.dexterity = [np.array([option[1] for option in itemOptions]) for itemOptions in options]
+		self.baseAttack = base_attack
+		self.baseDexterity = base_dexterity
+		self.defense = defense
+		self.topN = top_n
+		self.modifiers = modifiers
+
+		# best case ATT / DEX from every item after the one at each depth
+		self.remainingAttack = np.zeros(len(options) + 1)
+		self.remainingDexterity = np.zeros(len(options) + 1)
+		for depth in range(len(options) - 1, -1, -1):
+			self.remainingAttack[depth] = self.remainingAttack[depth + 1] + self.attack[depth].max()
+			self.remainingDexterity[depth] = self.remainingDexterity[depth + 1] + self.dexterity[depth].max()
+
+	def score(self, attack, dexterity):
+		return dps(*self.weapon, self.defense, attack, dexterity, **self.modifiers)
+
+	def firstBounds(self):
+		# upper bound for every option on the first item, used to hand the best branches out first
+		return self.score(
+			self.baseAttack + self.attack[0] + self.remainingAttack[1],
+			self.baseDexterity + self.dexterity[0] + self.remainingDexterity[1],
+		)
+
+	def run(self, first_options):
+		# searches every branch starting with one of first_options, returns (dps, option indices) best first
+		best = []
+		for option in first_options:
+			self._search(1, self.baseAttack + self.attack[0][option], self.baseDexterity + self.dexterity[0][option],
+			             (int(option),), best)
+		return sorted(best, reverse=True)
+
+	def _search(self, depth, attack, dexterity, chosen, best):
+		if depth == len(self.attack):
+			self._keep(best, float(self.score(attack, dexterity)), chosen)
+			return
+
+		if depth == len(self.attack) - 1:
+			# last item, score all of its options in one go
+			scores = self.score(attack + self.attack[depth], dexterity + self.dexterity[depth])
+			for option in np.argsort(-scores):
+				if not self._keep(best, float(scores[option]), chosen + (int(option),)):
+					break
+			return
+
+		bounds = self.score(
+			attack + self.attack[depth] + self.remainingAttack[depth + 1],
+			dexterity + self.dexterity[depth] + self.remainingDexterity[depth + 1],
+		)
+		for option in np.argsort(-bounds):
+			if len(best) == self.topN and bounds[option] <= best[0][0]:
+				break
+			self._search(depth + 1, attack + self.attack[depth][option], dexterity + self.dexterity[depth][option],
+			             chosen + (int(option),), best)
+
+	def _keep(self, best, score, chosen):
+		# adds a build to the top N heap, returns False if it wasn't good enough
+		if len(best) < self.topN:
+			heapq.heappush(best, (score, chosen))
+			return True
+		if score <= best[0][0]:
+			return False
+		heapq.heapreplace(best, (score, chosen))
+		return True
+
+
+# the search each worker process runs, set once by the pool initializer rather than pickled with every task
+_workerSearch = None
+
+
+def _initWorker(search):
+	global _workerSearch
+	_workerSearch = search
+
+
+def _runWorker(first_options):
+	return _workerSearch.run(first_options)
+
+
+def optimiseBuild(loadout, enchantments, base_attack, base_dexterity, defense, top_n=10, slots=4, workers=None,
+                  **modifiers):
+	"""
+	finds the top N enchantment builds by DPS for a loadout against an enemy defense
+
+	:arg	loadout: item records (weapon, ability, armor, ring), empty slots can be None
+	:arg	enchantments: every enchantment record that can be rolled, or an EnchantmentMasks already built from them
+	:arg	base_attack / base_dexterity: character stats before enchantments (class, exaltations, equipment)
+	:arg	slots: enchantment slots per item
+	:arg	workers: worker processes, defaults to one per core, 1 searches in this process
+	:arg	modifiers: passed to calculator.dps (status effects, damage_multiplier)
+
+	:returns: list of Build, best first
+	"""
+	items = [item for item in loadout if item is not None]
+	weapon = next((item for item in items if "WEAPON" in item.labels), None)
+	if weapon is None:
+		raise ValueError("loadout has no weapon to calculate DPS for")
+
+	masks = enchantments if isinstance(enchantments, EnchantmentMasks) else EnchantmentMasks(enchantments)
+	options = [distinctOptions(enchantmentOptions(item, masks, slots), top_n) for item in items]
+	search = BuildSearch(weapon, options, base_attack, base_dexterity, defense, top_n, modifiers)
+
+	# best branches first, dealt out round robin so every worker gets a share of the promising ones
+	order = np.argsort(-search.firstBounds())
+	workers = workers or os.cpu_count() or 1
+
+	if workers == 1:
+		found = search.run(order)
+	else:
+		chunks = [order[start::workers * 4] for start in range(min(len(order), workers * 4))]
+		with ProcessPoolExecutor(max_workers=workers, initializer=_initWorker, initargs=(search,)) as pool:
+			found = [result for results in pool.map(_runWorker, chunks) for result in results]
+
+	builds = []
+	for score, chosen in heapq.nlargest(top_n, found):
+		attack = base_attack + sum(search.attack[depth][option] for depth, option in enumerate(chosen))
+		dexterity = base_dexterity + sum(search.dexterity[depth][option] for depth, option in enumerate(chosen))
+		builds.append(Build(
+			score, float(attack), float(dexterity),
+			tuple(options[depth][option][2] for depth, option in enumerate(chosen)),
+		))
+	return builds
@@ -0,0 +1,149 @@
+import numpy as np
+
+"""
+Vectorised DPS engine
+
+Evaluates the weapon damage formula from outline.md over NumPy arrays, so many weapons against many enemy defense
+values come out of a single call, one DPS-vs-defense curve per weapon. The web app draws full curves for hundreds
+of items per request which scalar loops can't keep up with.
+
+Order of calculation (per shot)
+	1. damage roll, uniform between min and max damage, scaled by the attack multiplier and any % damage (exaltations)
+	2. enemy defense - Armor Broken sets it to 0, Exposed takes 20 off (not below 0), armor piercing ignores it
+	3. defense is subtracted from the shot, but a shot always deals at least 10% of its damage (the 90% defense cap)
+	4. Curse, +25% damage taken, applied last
+
+DPS is then shots per attack * attacks per second * average damage per shot. The average is taken over the whole
+damage roll rather than just (min + max) / 2, the two differ once defense starts eating into the low rolls.
+
+Formulae - https://www.realmeye.com/wiki/character-stats
+"""
+
+# the most a shot can be reduced by defense
+DEFENSE_CAP = 0.9
+EXPOSED_DEFENSE = 20
+CURSE_MULTIPLIER = 1.25
+DAMAGING_MULTIPLIER = 1.25
+BERSERK_MULTIPLIER = 1.25
+
+
+def attackMultiplier(attack, damaging=False, weak=False):
+	# damage multiplier from ATT, weak drops it to the minimum
+	multiplier = 0.5 + np.asarray(attack, dtype=np.float64) / 50
+	if weak:
+		multiplier = np.full_like(multiplier, 0.5)
+	if damaging:
+		multiplier = multiplier * DAMAGING_MULTIPLIER
+	return multiplier
+
+
+def attacksPerSecond(dexterity, rate_of_fire=1.0, berserk=False, dazed=False):
+	# attacks per second from DEX and the weapon rate of fire, dazed counts as 0 DEX
+	dexterity = np.asarray(dexterity, dtype=np.float64)
+	if dazed:
+		dexterity = np.zeros_like(dexterity)
+	aps = (1.5 + 6.5 * (dexterity / 75)) * rate_of_fire
+	if berserk:
+		aps = aps * BERSERK_MULTIPLIER
+	return aps
+
+
+def effectiveDefense(defense, exposed=False, armor_broken=False):
+	defense = np.asarray(defense, dtype=np.float64)
+	if armor_broken:
+		return np.zeros_like(defense)
+	if exposed:
+		return np.maximum(defense - EXPOSED_DEFENSE, 0)
+	return defense
+
+
+def expectedShotDamage(low, high, defense):
+	"""
+	average damage of a shot rolled uniformly between low and high against defense, all arrays broadcast
+
+	a roll x deals max(x - defense, 0.1x), the switch over is at x = defense / 0.9 so the average is the two
+	integrals either side of that point over the width of the roll
+	"""
+	low, high, defense = np.broadcast_arrays(
+		np.asarray(low, dtype=np.float64), np.asarray(high, dtype=np.float64), np.asarray(defense, dtype=np.float64))
+	floor = 1 - DEFENSE_CAP
+
+	split = np.clip(defense / DEFENSE_CAP, low, high)
+	capped = 0.5 * floor * (split * split - low * low)
+	reduced = 0.5 * (high * high - split * split) - defense * (high - split)
+
+	width = high - low
+	fixed = np.maximum(low - defense, floor * low)
+	average = np.divide(capped + reduced, width, out=np.array(fixed, dtype=np.float64), where=width > 0)
+	return average
+
+
+def dps(min_damage, max_damage, shots, rate_of_fire, armor_piercing, defense, attack, dexterity,
+        damage_multiplier=1.0, exposed=False, armor_broken=False, cursed=False, damaging=False, weak=False,
+        berserk=False, dazed=False):
+	"""
+	DPS for every combination of the inputs, all arguments broadcast against each other like any NumPy ufunc
+
+	:arg	damage_multiplier: any flat % damage on top of ATT, e.g. 1.1 for exaltations
+	:arg	exposed / armor_broken / cursed: enemy status effects
+	:arg	damaging / weak / berserk / dazed: player status effects
+	"""
+	multiplier = attackMultiplier(attack, damaging=damaging, weak=weak) * damage_multiplier
+	enemyDefense = effectiveDefense(defense, exposed=exposed, armor_broken=armor_broken)
+	enemyDefense = np.where(np.asarray(armor_piercing, dtype=bool), 0.0, enemyDefense)
+
+	shotDamage = expectedShotDamage(
+		np.asarray(min_damage, dtype=np.float64) * multiplier,
+		np.asarray(max_damage, dtype=np.float64) * multiplier,
+		enemyDefense,
+	)
+	if cursed:
+		shotDamage = shotDamage * CURSE_MULTIPLIER
+
+	return shotDamage * shots * attacksPerSecond(dexterity, rate_of_fire, berserk=berserk, dazed=dazed)
+
+
+class WeaponArrays:
+	"""
+	the damage fields of a list of weapons as parallel arrays, one entry per weapon
+
+	build it once per item list and reuse it for every curve request
+	"""
+
+	def __init__(self, weapons):
+		self.weapons = list(weapons)
+		self.minDamage = np.array([weapon.minDamage for weapon in self.weapons], dtype=np.float64)
+		self.maxDamage = np.array([weapon.maxDamage for weapon in self.weapons], dtype=np.float64)
+		self.shots = np.array([weapon.numProjectiles for weapon in self.weapons], dtype=np.float64)
+		self.rateOfFire = np.array([weapon.rateOfFire for weapon in self.weapons], dtype=np.float64)
+		self.armorPiercing = np.array([weapon.armorPiercing for weapon in self.weapons], dtype=bool)
+
+	def __len__(self):
+		return len(self.weapons)
+
+
+def dpsCurves(weapons, defense, attack, dexterity, **modifiers):
+	"""
+	DPS-vs-defense curves for every weapon in one pass
+
+	:arg	weapons: WeaponArrays (or anything with the same array attributes)
+	:arg	defense: 1d array of enemy defense values, e.g. np.arange(0, 101)
+	:arg	attack / dexterity: scalars, or arrays with one entry per weapon
+	:arg	modifiers: passed through to dps (status effects, damage_multiplier)
+
+	:returns: array of shape (weapons, defense values)
+	"""
+	def column(values):
+		return np.asarray(values, dtype=np.float64).reshape(-1, 1)
+
+	return dps(
+		column(weapons.minDamage),
+		column(weapons.maxDamage),
+		column(weapons.shots),
+		column(weapons.rateOfFire),
+		np.asarray(weapons.armorPiercing, dtype=bool).reshape(-1, 1),
+		np.asarray(defense, dtype=np.float64).reshape(1, -1),
+		column(attack) if np.ndim(attack) else attack,
+		column(dexterity) if np.ndim(dexterity) else dexterity,
+		**modifiers,
+	)
@@ -1,57 +1,221 @@
-import xml.etree.ElementTree as ET
+from RotMGCalc.project.itemindex import getTypeIndex
+
+"""
+Character stats are resolved in the order given in outline.md, one stage at a time
+
+	base - class starting stats
+	level - LevelIncrease per level (or the class max stats once maxed)
+	exaltation - flat stats from exaltations
+	equipment - flat stats from equipped items
+	enchantment - flat stats from the enchantments on those items
+	bonus - % bonuses, these are made after every flat increase
+	buffs - currently active buffs
+
+Every stage is cached, a change only throws away the stage it belongs to and the ones after it, so swapping a ring
+re-runs equipment onwards but never the class base or exaltations. The UI re-evaluates on every slider / dropdown
+change so this keeps each edit well under a millisecond.
+
+Class data comes from the shared item index (itemindex.getTypeIndex), which is only loaded the first time a class is
+looked up, importing this module doesn't read anything.
+"""
+
+STAGES = ("base", "level", "exaltation", "equipment", "enchantment", "bonus", "buffs")
+# weapon, ability, armour, ring
+EQUIPMENT_SLOTS = 4
+
+
+def _addStats(stats, bonuses):
+	for stat, amount in bonuses:
+		stats[stat] = stats.get(stat, 0.0) + amount
+
+
+# example of a character
+# <Object type="0x0300" id="Rogue">
+#   <Class>Player</Class>
+#   <Description>The rogue relies on his speed to deal damage at medium range while avoiding attacks.</Description>
+#   <AnimatedTexture>
+#     <File>players</File>
+#     <Index>0</Index>
+#   </AnimatedTexture>
+#   <HitSound>player/rogue_hit</HitSound>
+#   <DeathSound>player/rogue_death</DeathSound>
+#   <Player />
+#   <BloodProb>1.0</BloodProb>
+#   <SlotTypes>2, 13, 6, 9, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0</SlotTypes>
+#   <Equipment>0xa14, 0xa56, 0xa78, -1, 0xa22, -1, -1, -1, -1, -1, -1, -1, -1, -1, -1, -1, -1, -1, -1</Equipment>
+#   <MaxHitPoints max="750">150</MaxHitPoints>
+#   <MaxMagicPoints max="252">100</MaxMagicPoints>
+#   <Attack max="55">16</Attack>
+#   <Defense max="25">0</Defense>
+#   <Speed max="65">26</Speed>
+#   <Dexterity max="75">17</Dexterity>
+#   <HpRegen max="40">5</HpRegen>
+#   <MpRegen max="50">15</MpRegen>
+#   <LevelIncrease min="25" max="25">MaxHitPoints</LevelIncrease>
+#   <LevelIncrease min="5" max="5">MaxMagicPoints</LevelIncrease>
+#   <LevelIncrease min="1" max="1">Attack</LevelIncrease>
+#   <LevelIncrease min="0" max="1">Defense</LevelIncrease>
+#   <LevelIncrease min="1" max="1">Speed</LevelIncrease>
+#   <LevelIncrease min="2" max="2">Dexterity</LevelIncrease>
+#   <LevelIncrease min="1" max="1">HpRegen</LevelIncrease>
+#   <LevelIncrease min="1" max="1">MpRegen</LevelIncrease>
+#   <UnlockLevel level="5" type="0x0307">Archer</UnlockLevel>
+#   <UnlockCost>199</UnlockCost>
+# </Object>
 
-# todo - set as environment variable
-players = r'C:\Code\RotMGCalc\localfiles\xml\Players.xml'
 
 class Character:
-	def __init__(self):
-		return
-
-	tree = ET.parse(players)
-	root = tree.getroot()
-
-	# retrieve character information from XML
-	for childs in root:
-		if childs.tag == 'Object':
-			print(f"{childs.attrib.get('id')}")
-			for rotmgClass in childs:
-				print(f"{rotmgClass.tag}" f"{rotmgClass.text}")
-		# example of a character
-		# <Object type="0x0300" id="Rogue">
-		  #   <Class>Player</Class>
-		  #   <Description>The rogue relies on his speed to deal damage at medium range while avoiding attacks.</Description>
-		  #   <AnimatedTexture>
-		  #     <File>players</File>
-		  #     <Index>0</Index>
-		  #   </AnimatedTexture>
-		  #   <HitSound>player/rogue_hit</HitSound>
-		  #   <DeathSound>player/rogue_death</DeathSound>
-		  #   <Player />
-		  #   <BloodProb>1.0</BloodProb>
-		  #   <SlotTypes>2, 13, 6, 9, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0</SlotTypes>
-		  #   <Equipment>0xa14, 0xa56, 0xa78, -1, 0xa22, -1, -1, -1, -1, -1, -1, -1, -1, -1, -1, -1, -1, -1, -1</Equipment>
-		  #   <MaxHitPoints max="750">150</MaxHitPoints>
-		  #   <MaxMagicPoints max="252">100</MaxMagicPoints>
-		  #   <Attack max="55">16</Attack>
-		  #   <Defense max="25">0</Defense>
-		  #   <Speed max="65">26</Speed>
-		  #   <Dexterity max="75">17</Dexterity>
-		  #   <HpRegen max="40">5</HpRegen>
-		  #   <MpRegen max="50">15</MpRegen>
-		  #   <LevelIncrease min="25" max="25">MaxHitPoints</LevelIncrease>
-		  #   <LevelIncrease min="5" max="5">MaxMagicPoints</LevelIncrease>
-		  #   <LevelIncrease min="1" max="1">Attack</LevelIncrease>
-		  #   <LevelIncrease min="0" max="1">Defense</LevelIncrease>
-		  #   <LevelIncrease min="1" max="1">Speed</LevelIncrease>
-		  #   <LevelIncrease min="2" max="2">Dexterity</LevelIncrease>
-		  #   <LevelIncrease min="1" max="1">HpRegen</LevelIncrease>
-		  #   <LevelIncrease min="1" max="1">MpRegen</LevelIncrease>
-		  #   <UnlockLevel level="5" type="0x0307">Archer</UnlockLevel>
-		  #   <UnlockCost>199</UnlockCost>
-		# </Object>
+	def __init__(self, player_class, level=20, maxed=True):
+		"""
+		:arg	player_class: PlayerClassRecord for the class (see itemindex)
+		:arg	level: character level, only used when not maxed
+		:arg	maxed: use the class max stats rather than the level increases
+		"""
+		self.playerClass = player_class
+		self.level = level
+		self.maxed = maxed
+		self.exaltations = {}
+		# raw % damage increase from exaltations, added on top of everything
+		self.exaltationDamage = 0.0
+		self.equipment = [None] * EQUIPMENT_SLOTS
+		self.enchantments = [()] * EQUIPMENT_SLOTS
+		self.bonusPercent = {}
+		self.buffs = {}
+
+		# resolved stats after each stage, None once a stage needs recomputing
+		self._stages = [None] * len(STAGES)
+
+	@classmethod
+	def fromClass(cls, player_class, **kwargs):
+		"""
+		builds a character from a class type id ("0x0300" / 768) or name ("Rogue") with the class starting equipment
+
+		this is the first point the item index is loaded
+		"""
+		typeIndex = getTypeIndex()
+		if isinstance(player_class, str) and not player_class.lower().startswith("0x"):
+			record = typeIndex.classesById.get(player_class)
+		else:
+			record = typeIndex.playerClass(player_class)
+		if record is None:
+			raise KeyError(f"Unknown class {player_class}")
+
+		character = cls(record, **kwargs)
+		for slot, item in enumerate(typeIndex.resolveLoadout(record.equipment[:EQUIPMENT_SLOTS])):
+			character.setEquipment(slot, item)
+		return character
+
+	def invalidate(self, stage):
+		# drops the cached result of `stage` and every stage after it
+		for index in range(STAGES.index(stage), len(STAGES)):
+			if self._stages[index] is None:
+				break
+			self._stages[index] = None
+
+	def setLevel(self, level, maxed=None):
+		maxed = self.maxed if maxed is None else maxed
+		if (level, maxed) != (self.level, self.maxed):
+			self.level, self.maxed = level, maxed
+			self.invalidate("level")
+
+	def setExaltations(self, stats, damage=None):
+		# stats - stat name -> flat amount, damage - % damage increase
+		if damage is not None:
+			self.exaltationDamage = damage
+		if stats != self.exaltations:
+			self.exaltations = dict(stats)
+			self.invalidate("exaltation")
+
+	def setEquipment(self, slot, item):
+		if self.equipment[slot] is not item:
+			self.equipment[slot] = item
+			self.invalidate("equipment")
+
+	def setEnchantments(self, slot, enchantments):
+		enchantments = tuple(enchantments)
+		if self.enchantments[slot] != enchantments:
+			self.enchantments[slot] = enchantments
+			self.invalidate("enchantment")
+
+	def setBonusPercent(self, stats):
+		# stat name -> % bonus
+		if stats != self.bonusPercent:
+			self.bonusPercent = dict(stats)
+			self.invalidate("bonus")
+
+	def setBuffs(self, stats):
+		# stat name -> flat amount from currently active buffs
+		if stats != self.buffs:
+			self.buffs = dict(stats)
+			self.invalidate("buffs")
+
+	def stats(self, stage="buffs"):
+		"""
+		resolved stats up to and including `stage`, only the stages which have been invalidated are recomputed
+
+		the returned dictionary is the cached one, copy it before changing it
+		"""
+		last = STAGES.index(stage)
+		first = 0
+		while first <= last and self._stages[first] is not None:
+			first += 1
+
+		for index in range(first, last + 1):
+			previous = self._stages[index - 1] if index else None
+			self._stages[index] = getattr(self, f"_{STAGES[index]}Stage")(previous)
+
+		return self._stages[last]
+
+	@property
+	def weapon(self):
+		return self.equipment[0]
+
+	@property
+	def damageMultiplier(self):
+		return 1 + self.exaltationDamage / 100
+
+	def _baseStage(self, _):
+		return dict(self.playerClass.baseStats)
+
+	def _levelStage(self, stats):
+		maxStats = dict(self.playerClass.maxStats)
+		if self.maxed:
+			return maxStats
 
+		stats = dict(stats)
+		# average of the min / max roll per level
+		_addStats(stats, (
+			(stat, (low + high) / 2 * (self.level - 1)) for stat, low, high in self.playerClass.levelIncrease
+		))
+		return {stat: min(value, maxStats.get(stat, value)) for stat, value in stats.items()}
 
+	def _exaltationStage(self, stats):
+		stats = dict(stats)
+		_addStats(stats, self.exaltations.items())
+		return stats
 
+	def _equipmentStage(self, stats):
+		stats = dict(stats)
+		for item in self.equipment:
+			if item is not None:
+				_addStats(stats, item.statBonuses)
+		return stats
 
+	def _enchantmentStage(self, stats):
+		stats = dict(stats)
+		for enchantments in self.enchantments:
+			for enchantment in enchantments:
+				_addStats(stats, enchantment.statBonuses)
+		return stats
 
+	def _bonusStage(self, stats):
+		if not self.bonusPercent:
+			return stats
+		return {stat: value * (1 + self.bonusPercent.get(stat, 0.0) / 100) for stat, value in stats.items()}
 
+	def _buffsStage(self, stats):
+		if not self.buffs:
+			return stats
+		stats = dict(stats)
+		_addStats(stats, self.buffs.items())
+		return stats
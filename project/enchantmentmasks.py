@@ -0,0 +1,114 @@
+"""
+Precomputed enchantment compatibility as integer bitmasks
+
+The rules in Enchantments.xml are comma separated label lists - EnchantmentLabels, IncompatibleWithEnchantmentLabels,
+CompatibleWithItemLabels, IncompatibleWithItemLabels and IncompatibleWithItemIds. Checking them as string sets means
+building and intersecting sets in the inner loop of every build search or validation, so instead every label is given
+a bit once and each enchantment (and item) gets its labels and exclusions as plain ints, a check is then a few ANDs.
+
+Enchantment labels and item labels are separate namespaces (ATTACK on an enchantment is not ATTACK on an item) so
+they each get their own bits. Item ids only get a bit if an enchantment actually excludes them
+"""
+
+
+class LabelBits:
+	# hands out one bit per distinct label, in the order they are first seen
+	def __init__(self):
+		self.bits = {}
+
+	def bit(self, label):
+		try:
+			return self.bits[label]
+		except KeyError:
+			self.bits[label] = bit = 1 << len(self.bits)
+			return bit
+
+	def mask(self, labels):
+		mask = 0
+		for label in labels:
+			mask |= self.bit(label)
+		return mask
+
+	def knownMask(self, labels):
+		# like mask, but labels which were never interned are ignored instead of being given a new bit
+		mask = 0
+		for label in labels:
+			mask |= self.bits.get(label, 0)
+		return mask
+
+
+def _itemIdKey(itemId):
+	# IncompatibleWithItemIds can hold either the item name or its "0x..." type, hex is normalised to lower case
+	itemId = itemId.strip()
+	return itemId.lower() if itemId.lower().startswith("0x") else itemId
+
+
+class EnchantmentMasks:
+	"""
+	bitmask form of the compatibility rules for a list of enchantment records
+
+	every per enchantment list is indexed the same way as `enchantments`, `position` maps a type id to that index
+	"""
+
+	def __init__(self, enchantments):
+		self.enchantments = list(enchantments)
+		self.position = {enchantment.type: index for index, enchantment in enumerate(self.enchantments)}
+
+		self.enchantmentLabelBits = LabelBits()
+		self.itemLabelBits = LabelBits()
+		self.itemIdBits = LabelBits()
+
+		self.labels = []
+		self.incompatibleLabels = []
+		self.compatibleItemLabels = []
+		self.incompatibleItemLabels = []
+		self.incompatibleItemIds = []
+
+		for enchantment in self.enchantments:
+			self.labels.append(self.enchantmentLabelBits.mask(enchantment.labels))
+			self.incompatibleLabels.append(self.enchantmentLabelBits.mask(enchantment.incompatibleLabels))
+			self.compatibleItemLabels.append(self.itemLabelBits.mask(enchantment.compatibleItemLabels))
+			self.incompatibleItemLabels.append(self.itemLabelBits.mask(enchantment.incompatibleItemLabels))
+			self.incompatibleItemIds.append(self.itemIdBits.mask(_itemIdKey(i) for i in enchantment.incompatibleItemIds))
+
+		self._itemMasks = {}
+
+	def itemMasks(self, item):
+		# (label mask, id mask) for an item record, cached by type id
+		try:
+			return self._itemMasks[item.type]
+		except KeyError:
+			masks = (
+				self.itemLabelBits.knownMask(item.labels),
+				self.itemIdBits.knownMask((item.id, f"{item.type:#x}")),
+			)
+			self._itemMasks[item.type] = masks
+			return masks
+
+	def compatibleWithItem(self, index, item):
+		# can the enchantment at `index` go on the item at all
+		labels, ids = self.itemMasks(item)
+		return bool(
+			labels & self.compatibleItemLabels[index]
+			and not labels & self.incompatibleItemLabels[index]
+			and not ids & self.incompatibleItemIds[index]
+		)
+
+	def canCoexist(self, first, second):
+		# can the enchantments at indexes first and second share an item
+		return first != second and not (
+			self.labels[first] & self.incompatibleLabels[second]
+			or self.labels[second] & self.incompatibleLabels[first]
+		)
+
+	def canAdd(self, index, labels, exclusions):
+		"""
+		can the enchantment at `index` join a set whose combined label / exclusion masks are labels / exclusions
+
+		keeping those two running ORs while building a set makes checking a new member O(1) whatever the set size
+		"""
+		return not (self.labels[index] & exclusions or self.incompatibleLabels[index] & labels)
+
+	def canCoexistOnItem(self, first, second, item):
+		return self.canCoexist(first, second) and self.compatibleWithItem(first, item) and \
+			self.compatibleWithItem(second, item)
@@ -1,35 +1,57 @@
-import xml.etree.ElementTree as ET
+from RotMGCalc.project.enchantmentmasks import EnchantmentMasks
+from RotMGCalc.project.itemindex import getTypeIndex
+
+"""
+Enchantment data, loaded from the shared item index (itemindex.getTypeIndex) on first access
+
+nothing is read when this module is imported, the index and the compatibility masks are only built the first time
+something is looked up and are then shared for the rest of the process
+"""
+
+# This is an example of an enchantment
+# <Enchantment id="Defense_Dexterity_Tradeoff_4" type="0x4C2">
+# <DisplayId>Defense -Dexterity Tradeoff IV</DisplayId>
+# <Texture>
+#   <File>enchantments16x16</File>
+#   <Index>49</Index>
+# </Texture>
+# <Description>Increases Defense by 5 decreases Dexterity by 3.8</Description>
+# <Weight>1875</Weight>
+# <CompatibleWithItemLabels>EQUIPMENT</CompatibleWithItemLabels>
+# <IncompatibleWithItemLabels />
+# <IncompatibleWithItemIds />
+# <EnchantmentLabels>STAT,DUALSTAT,DEFENSE,DEXTERITY,TRADEOFF,ROLLABLE,TIER4</EnchantmentLabels>
+# <IncompatibleWithEnchantmentLabels>DUALSTAT</IncompatibleWithEnchantmentLabels>
+# <Mutators>
+#   <ActivateOnEquip stat="DEF" amount="5">IncrementStat</ActivateOnEquip>
+#   <ActivateOnEquip stat="DEX" amount="-3.8">IncrementStat</ActivateOnEquip>
+# </Mutators>
+# <PowerLevelAdd>0</PowerLevelAdd>
+# <PowerLevelMult>1</PowerLevelMult>
 
-enchantmentsXML = r'C:\Code\RotMGCalc\localfiles\xml\Enchantments.xml'
 
 class Enchantment:
-	def __init__(self):
-		return
-
-	tree = ET.parse(enchantmentsXML)
-	root = tree.getroot()
-
-	# retrieve character information from XML
-	for childs in root:
-		if childs.tag == 'Enchantment':
-			print(childs.attrib, childs.text)
-	# This is an example of an enchantment
-	# <Enchantment id="Defense_Dexterity_Tradeoff_4" type="0x4C2">
-    # <DisplayId>Defense -Dexterity Tradeoff IV</DisplayId>
-    # <Texture>
-    #   <File>enchantments16x16</File>
-    #   <Index>49</Index>
-    # </Texture>
-    # <Description>Increases Defense by 5 decreases Dexterity by 3.8</Description>
-    # <Weight>1875</Weight>
-    # <CompatibleWithItemLabels>EQUIPMENT</CompatibleWithItemLabels>
-    # <IncompatibleWithItemLabels />
-    # <IncompatibleWithItemIds />
-    # <EnchantmentLabels>STAT,DUALSTAT,DEFENSE,DEXTERITY,TRADEOFF,ROLLABLE,TIER4</EnchantmentLabels>
-    # <IncompatibleWithEnchantmentLabels>DUALSTAT</IncompatibleWithEnchantmentLabels>
-    # <Mutators>
-    #   <ActivateOnEquip stat="DEF" amount="5">IncrementStat</ActivateOnEquip>
-    #   <ActivateOnEquip stat="DEX" amount="-3.8">IncrementStat</ActivateOnEquip>
-    # </Mutators>
-    # <PowerLevelAdd>0</PowerLevelAdd>
-    # <PowerLevelMult>1</PowerLevelMult>
\ No newline at end of file
+	_masks = None
+	_masksIndex = None
+
+	@staticmethod
+	def get(type_id):
+		# enchantment record for a type id ("0x4C2" / 1218), None if it doesn't exist
+		return getTypeIndex().enchantment(type_id)
+
+	@staticmethod
+	def all():
+		return list(getTypeIndex().enchantments.values())
+
+	@staticmethod
+	def withLabel(label):
+		return getTypeIndex().enchantmentsWithLabel(label)
+
+	@classmethod
+	def masks(cls):
+		# compatibility bitmasks over every enchantment, built once (and again if the data source is changed)
+		typeIndex = getTypeIndex()
+		if cls._masksIndex is not typeIndex:
+			cls._masks = EnchantmentMasks(typeIndex.enchantments.values())
+			cls._masksIndex = typeIndex
+		return cls._masks
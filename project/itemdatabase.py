@@ -0,0 +1,261 @@
+import marshal
+import os
+import struct
+import time
+
+from RotMGCalc.project.utils.xmlStreaming import iterElements, parseLabels
+
+"""
+Compiled item database
+
+Every tool used to re-parse Players.xml, Equip.xml and Enchantments.xml on load, which is seconds of work before
+anything useful happens. This module does that once, as a build step, and writes the parts of the XML the calculator
+actually uses to a single versioned binary file. Loading that file back is a header check and one marshal.loads, so
+the calculator and Django start in milliseconds.
+
+Build the database whenever the game XML is re-extracted:
+
+		python -m RotMGCalc.project.itemdatabase
+
+File layout
+	header - magic (4s), format version (H), marshal version (H), build time (d), payload length (I)
+	payload - marshal encoded dict of section name -> list of record tuples, field order is given by the *_FIELDS
+	tuples below
+
+marshal is only guaranteed to round trip on the same marshal version, that is stored in the header and checked on
+load, if it does not match just rebuild the database
+"""
+
+PLAYERS_XML = os.environ.get("PLAYERS_XML")
+EQUIP_XML = os.environ.get("EQUIP_XML")
+ENCHANTMENTS_XML = os.environ.get("ENCHANTMENTS_XML")
+# compiled output of the three XML files above, kept next to this module by default so every tool (Django, the GUI,
+# scripts) finds the same file wherever it was started from
+ITEM_DATABASE = os.environ.get(
+	"ITEM_DATABASE", os.path.join(os.path.dirname(os.path.abspath(__file__)), "itemdatabase.bin"))
+
+DATABASE_MAGIC = b"RMDB"
+# bump this whenever a *_FIELDS tuple changes
+FORMAT_VERSION = 1
+HEADER = struct.Struct("<4sHHdI")
+
+ITEM_FIELDS = (
+	"type", "id", "displayId", "labels", "slotType", "tier", "textureFile", "textureIndex",
+	"minDamage", "maxDamage", "numProjectiles", "rateOfFire", "armorPiercing", "statBonuses",
+)
+CLASS_FIELDS = (
+	"type", "id", "slotTypes", "equipment", "baseStats", "maxStats", "levelIncrease",
+)
+ENCHANTMENT_FIELDS = (
+	"type", "id", "displayId", "labels", "incompatibleLabels", "compatibleItemLabels", "incompatibleItemLabels",
+	"incompatibleItemIds", "weight", "statBonuses",
+)
+
+# stat tags as they appear on a <Object> in Players.xml, these are the names used everywhere else
+CLASS_STATS = (
+	"MaxHitPoints", "MaxMagicPoints", "Attack", "Defense", "Speed", "Dexterity", "HpRegen", "MpRegen",
+)
+
+# ActivateOnEquip uses either the numeric stat codes (older files) or the short names, both map onto CLASS_STATS
+STAT_NAMES = {
+	"0": "MaxHitPoints", "3": "MaxMagicPoints", "20": "Attack", "21": "Defense", "22": "Speed",
+	"26": "HpRegen", "27": "MpRegen", "28": "Dexterity",
+	"MAXHP": "MaxHitPoints", "HP": "MaxHitPoints", "LIFE": "MaxHitPoints",
+	"MAXMP": "MaxMagicPoints", "MP": "MaxMagicPoints", "MANA": "MaxMagicPoints",
+	"ATT": "Attack", "DEF": "Defense", "SPD": "Speed", "DEX": "Dexterity", "VIT": "HpRegen", "WIS": "MpRegen",
+}
+
+
+def parseTypeId(value):
+	# type="0x4C2" -> 1218, also copes with plain decimal ids
+	return int(value.strip(), 0)
+
+
+def statName(stat):
+	if stat is None:
+		return None
+	return STAT_NAMES.get(stat.strip().upper(), stat.strip())
+
+
+def _float(text, default=0.0):
+	try:
+		return float(text)
+	except (TypeError, ValueError):
+		return default
+
+
+def _statBonuses(parent):
+	# flat stat increases from <ActivateOnEquip stat="ATT" amount="5">IncrementStat</ActivateOnEquip>
+	bonuses = []
+	for mutator in parent.findall("ActivateOnEquip"):
+		if (mutator.text or "").strip() != "IncrementStat":
+			continue
+		stat = statName(mutator.get("stat"))
+		if stat:
+			bonuses.append((stat, _float(mutator.get("amount"))))
+	return tuple(bonuses)
+
+
+def _idList(text):
+	# comma separated ids, order preserved as slot order matters for Equipment / SlotTypes
+	if not text:
+		return ()
+	return tuple(value.strip() for value in text.split(",") if value.strip())
+
+
+def readItems(equip_xml):
+	"""
+	yields a tuple per equipment <Object> in Equip.xml, see ITEM_FIELDS for the field order
+	only the first projectile of a weapon is used, this is the one which is shot every attack
+	"""
+	for obj in iterElements(equip_xml, "Object"):
+		if obj.findtext("Class") != "Equipment" or not obj.get("type"):
+			continue
+
+		projectile = obj.find("Projectile")
+		if projectile is not None:
+			damage = projectile.findtext("Damage")
+			minDamage = _float(projectile.findtext("MinDamage") or damage)
+			maxDamage = _float(projectile.findtext("MaxDamage") or damage)
+			armorPiercing = projectile.find("ArmorPiercing") is not None
+		else:
+			minDamage = maxDamage = 0.0
+			armorPiercing = False
+
+		tier = obj.findtext("Tier")
+
+		yield (
+			parseTypeId(obj.get("type")),
+			obj.get("id"),
+			obj.findtext("DisplayId"),
+			tuple(sorted(parseLabels(obj.findtext("Labels")))),
+			int(_float(obj.findtext("SlotType"))),
+			int(tier) if tier and tier.strip().lstrip("-").isdigit() else -1,
+			obj.findtext(".//Texture/File"),
+			int(_float(obj.findtext(".//Texture/Index"), -1)),
+			minDamage,
+			maxDamage,
+			int(_float(obj.findtext("NumProjectiles"), 1)) if projectile is not None else 0,
+			_float(obj.findtext("RateOfFire"), 1.0),
+			armorPiercing,
+			_statBonuses(obj),
+		)
+
+
+def readClasses(players_xml):
+	# yields a tuple per player class <Object> in Players.xml, see CLASS_FIELDS for the field order
+	for obj in iterElements(players_xml, "Object"):
+		if obj.find("Player") is None or not obj.get("type"):
+			continue
+
+		baseStats = []
+		maxStats = []
+		for stat in CLASS_STATS:
+			element = obj.find(stat)
+			if element is None:
+				continue
+			baseStats.append((stat, _float(element.text)))
+			maxStats.append((stat, _float(element.get("max"), _float(element.text))))
+
+		levelIncrease = tuple(
+			(statName(increase.text), _float(increase.get("min")), _float(increase.get("max")))
+			for increase in obj.findall("LevelIncrease")
+		)
+
+		yield (
+			parseTypeId(obj.get("type")),
+			obj.get("id"),
+			tuple(int(slot) for slot in _idList(obj.findtext("SlotTypes"))),
+			tuple(parseTypeId(item) for item in _idList(obj.findtext("Equipment"))),
+			tuple(baseStats),
+			tuple(maxStats),
+			levelIncrease,
+		)
+
+
+def readEnchantments(enchantments_xml):
+	# yields a tuple per <Enchantment> in Enchantments.xml, see ENCHANTMENT_FIELDS for the field order
+	for enchantment in iterElements(enchantments_xml, "Enchantment"):
+		if not enchantment.get("type"):
+			continue
+
+		mutators = enchantment.find("Mutators")
+
+		yield (
+			parseTypeId(enchantment.get("type")),
+			enchantment.get("id"),
+			enchantment.findtext("DisplayId"),
+			tuple(sorted(parseLabels(enchantment.findtext("EnchantmentLabels")))),
+			tuple(sorted(parseLabels(enchantment.findtext("IncompatibleWithEnchantmentLabels")))),
+			tuple(sorted(parseLabels(enchantment.findtext("CompatibleWithItemLabels")))),
+			tuple(sorted(parseLabels(enchantment.findtext("IncompatibleWithItemLabels")))),
+			_idList(enchantment.findtext("IncompatibleWithItemIds")),
+			int(_float(enchantment.findtext("Weight"))),
+			_statBonuses(mutators) if mutators is not None else (),
+		)
+
+
+def buildItemDatabase(players_xml, equip_xml, enchantments_xml, output_path=ITEM_DATABASE):
+	"""
+	reads the three game XML files and writes them to output_path as a single binary database
+
+	the file is written next to output_path first and then renamed over it, so a running server never loads a
+	half written database
+
+	:returns: record count per section
+	"""
+	sections = {
+		"items": list(readItems(equip_xml)),
+		"classes": list(readClasses(players_xml)),
+		"enchantments": list(readEnchantments(enchantments_xml)),
+	}
+	payload = marshal.dumps(sections)
+
+	tempPath = f"{output_path}.tmp"
+	with open(tempPath, "wb") as databaseFile:
+		databaseFile.write(HEADER.pack(DATABASE_MAGIC, FORMAT_VERSION, marshal.version, time.time(), len(payload)))
+		databaseFile.write(payload)
+	os.replace(tempPath, output_path)
+
+	return {name: len(records) for name, records in sections.items()}
+
+
+class ItemDatabase:
+	"""
+	the loaded contents of the database file, each section is a list of plain tuples in *_FIELDS order
+
+	the tuples are deliberately left as they are, turning them into richer objects is left to whatever consumes them
+	"""
+
+	def __init__(self, built, items, classes, enchantments):
+		self.built = built
+		self.items = items
+		self.classes = classes
+		self.enchantments = enchantments
+
+
+def loadItemDatabase(database_path=ITEM_DATABASE):
+	# loads the database written by buildItemDatabase, raises ValueError if it is from another format version
+	with open(database_path, "rb") as databaseFile:
+		data = databaseFile.read()
+
+	if len(data) < HEADER.size:
+		raise ValueError(f"{database_path} is too small to be an item database")
+
+	magic, formatVersion, marshalVersion, built, payloadLength = HEADER.unpack_from(data)
+	if magic != DATABASE_MAGIC:
+		raise ValueError(f"{database_path} is not an item database")
+	if formatVersion != FORMAT_VERSION or marshalVersion != marshal.version:
+		raise ValueError(
+			f"{database_path} was built with format {formatVersion} (marshal {marshalVersion}), expected "
+			f"{FORMAT_VERSION} (marshal {marshal.version}), rebuild it with buildItemDatabase")
+	if len(data) - HEADER.size != payloadLength:
+		raise ValueError(f"{database_path} is truncated, rebuild it with buildItemDatabase")
+
+	sections = marshal.loads(memoryview(data)[HEADER.size:])
+	return ItemDatabase(built, sections["items"], sections["classes"], sections["enchantments"])
+
+
+if __name__ == '__main__':
+	counts = buildItemDatabase(PLAYERS_XML, EQUIP_XML, ENCHANTMENTS_XML, ITEM_DATABASE)
+	print(f"Wrote {ITEM_DATABASE} - " + ", ".join(f"{count} {name}" for name, count in counts.items()))
@@ -0,0 +1,158 @@
+import os
+import threading
+from collections import defaultdict
+
+from RotMGCalc.project.itemdatabase import (
+	CLASS_FIELDS, ENCHANTMENT_FIELDS, ENCHANTMENTS_XML, EQUIP_XML, ITEM_DATABASE, ITEM_FIELDS, PLAYERS_XML,
+	buildItemDatabase, loadItemDatabase, parseTypeId,
+)
+
+"""
+In memory index over the item database
+
+Everything in the game XML is referenced by its type="0x..." id, a class lists its starting Equipment as type ids and
+the renaming tool tracks completed sprites the same way. Looking those up used to mean walking the element tree, this
+index maps the integer type id straight to a record, so resolving a full loadout is one dict lookup per slot.
+
+The records use __slots__ as there are thousands of them and they are never extended
+
+getTypeIndex is the shared, lazily loaded copy everything else should use - nothing is read until it is first called,
+so importing any of the modules which use it (character, enchantments) is free. setDataSource points it somewhere else
+"""
+
+
+class ItemRecord:
+	__slots__ = ITEM_FIELDS
+
+	def __init__(self, *values):
+		for field, value in zip(ITEM_FIELDS, values):
+			setattr(self, field, value)
+
+	def __repr__(self):
+		return f"ItemRecord({self.id!r}, type={self.type:#x})"
+
+
+class PlayerClassRecord:
+	__slots__ = CLASS_FIELDS
+
+	def __init__(self, *values):
+		for field, value in zip(CLASS_FIELDS, values):
+			setattr(self, field, value)
+
+	def __repr__(self):
+		return f"PlayerClassRecord({self.id!r}, type={self.type:#x})"
+
+
+class EnchantmentRecord:
+	__slots__ = ENCHANTMENT_FIELDS
+
+	def __init__(self, *values):
+		for field, value in zip(ENCHANTMENT_FIELDS, values):
+			setattr(self, field, value)
+
+	def __repr__(self):
+		return f"EnchantmentRecord({self.id!r}, type={self.type:#x})"
+
+
+def _typeKey(typeId):
+	# accepts both the int and the "0xa14" form used in the XML
+	return parseTypeId(typeId) if isinstance(typeId, str) else typeId
+
+
+class TypeIndex:
+	"""
+	type id -> record lookups for items, player classes and enchantments
+
+	secondary indexes
+		itemsByLabel - label (WEAPON, ABILITY, UT, ...) -> list of items
+		enchantmentsByLabel - enchantment label (STAT, TIER4, ...) -> list of enchantments
+		itemsByTexture - texture file (lofiObj, lofiObj2, ...) -> list of items
+	"""
+
+	def __init__(self, items, classes, enchantments):
+		self.items = {item.type: item for item in items}
+		self.classes = {playerClass.type: playerClass for playerClass in classes}
+		self.enchantments = {enchantment.type: enchantment for enchantment in enchantments}
+		self.classesById = {playerClass.id: playerClass for playerClass in classes}
+
+		self.itemsByLabel = defaultdict(list)
+		self.itemsByTexture = defaultdict(list)
+		for item in self.items.values():
+			for label in item.labels:
+				self.itemsByLabel[label].append(item)
+			if item.textureFile:
+				self.itemsByTexture[item.textureFile].append(item)
+
+		self.enchantmentsByLabel = defaultdict(list)
+		for enchantment in self.enchantments.values():
+			for label in enchantment.labels:
+				self.enchantmentsByLabel[label].append(enchantment)
+
+	@classmethod
+	def fromDatabase(cls, database):
+		return cls(
+			[ItemRecord(*record) for record in database.items],
+			[PlayerClassRecord(*record) for record in database.classes],
+			[EnchantmentRecord(*record) for record in database.enchantments],
+		)
+
+	@classmethod
+	def load(cls, database_path=ITEM_DATABASE):
+		return cls.fromDatabase(loadItemDatabase(database_path))
+
+	def item(self, typeId):
+		return self.items.get(_typeKey(typeId))
+
+	def playerClass(self, typeId):
+		return self.classes.get(_typeKey(typeId))
+
+	def enchantment(self, typeId):
+		return self.enchantments.get(_typeKey(typeId))
+
+	def itemsWithLabel(self, label):
+		return self.itemsByLabel.get(label.upper(), [])
+
+	def enchantmentsWithLabel(self, label):
+		return self.enchantmentsByLabel.get(label.upper(), [])
+
+	def itemsOnTexture(self, textureFile):
+		return self.itemsByTexture.get(textureFile, [])
+
+	def resolveLoadout(self, equipment):
+		"""
+		resolves a list of equipment type ids (as on a class <Equipment> or a saved character) to item records
+
+		empty slots (-1) and unknown ids resolve to None so the result lines up with SlotTypes
+		"""
+		return [self.items.get(_typeKey(typeId)) for typeId in equipment]
+
+
+# the shared index, loaded on first use from _dataSource
+_dataSource = ITEM_DATABASE
+_typeIndex = None
+_typeIndexLock = threading.Lock()
+
+
+def setDataSource(database_path):
+	# points getTypeIndex at another database, the current index is dropped and reloaded on next use
+	global _dataSource, _typeIndex
+	with _typeIndexLock:
+		_dataSource = database_path
+		_typeIndex = None
+
+
+def getTypeIndex():
+	"""
+	the shared TypeIndex, loaded from the data source on first call
+
+	if the database hasn't been built yet but the game XML paths are set (PLAYERS_XML, EQUIP_XML, ENCHANTMENTS_XML)
+	it is built first
+	"""
+	global _typeIndex
+	if _typeIndex is None:
+		with _typeIndexLock:
+			if _typeIndex is None:
+				if not os.path.exists(_dataSource) and PLAYERS_XML and EQUIP_XML and ENCHANTMENTS_XML:
+					buildItemDatabase(PLAYERS_XML, EQUIP_XML, ENCHANTMENTS_XML, _dataSource)
+				_typeIndex = TypeIndex.load(_dataSource)
+	return _typeIndex
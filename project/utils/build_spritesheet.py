@@ -28,11 +28,32 @@ Typical usage:
 Notes:
 - This script reads image headers to get width/height first (low memory),
   then does a second pass to paste them onto the final sheet(s).
+- The header scan and hashing run on a thread pool, and when there is more
+  than one sheet each sheet is composed and encoded in its own process.
+  --workers sets the size of both (default: CPU count).
+- --format picks the sheet encoding, each sheet reports its encode time and
+  file size:
+    png-fast      zlib level 1, for local iteration
+    png-balanced  zlib level 6
+    png-max       optimize + zlib level 9, smallest PNG (default)
+    webp-fast     lossless WebP at libwebp's default effort, for iteration
+    webp-max      lossless WebP at maximum effort, usually the smallest
+                  file but much slower to encode, for release builds
+  --indexed additionally stores sheets with 256 or fewer distinct RGBA
+  colours as a palette PNG, which suits 8x8 pixel art. It is exact, a
+  sheet with more colours is left as RGBA. Needs NumPy, PNG formats only.
 - By default it will attempt to pack everything into a single spritesheet
   up to --max-size. If it doesn't fit, it will automatically spill over
   to multiple sheets named <basename>_0.png, <basename>_1.png, etc.
 - If you want to ensure single file output only, pass --single-sheet to
   raise an error if it doesn't fit.
+- --packer picks the packing algorithm: "shelf" (default, fastest) or
+  "maxrects" (best-short-side-fit, wastes less area on mixed sizes).
+  Each sheet reports its efficiency (sprite area / sheet area) so the two
+  can be compared on sheet count and size.
+- Identical images (reskins, tiered duplicates) are packed once, every
+  duplicate id points at the same rect in the JSON. --no-dedupe packs
+  every file separately.
 
 JSON Schema example:
 {
@@ -57,9 +78,13 @@ JSON Schema example:
 from __future__ import annotations
 
 import argparse
+import hashlib
 import json
 import math
 import os
+import struct
+import time
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
 from dataclasses import dataclass
 from datetime import datetime, timezone
 from typing import Dict, List, Optional, Tuple
@@ -71,9 +96,23 @@ except Exception as e:
         f"Pillow is required. Install it with: pip install Pillow\nImport error: {e}"
     )
 
+try:
+    # The shared pixel hash, so dedup digests match the skip archive and the
+    # ImageHash values in spriteRenameComplete.xml
+    from RotMGCalc.project.utils.unusedSpriteToBinary import imageDigest
+except ImportError:
+    # Standalone run without the RotMGCalc package importable: a copy of
+    # unusedSpriteToBinary.imageDigest, only used when that can't be imported
+    def imageDigest(image: Image.Image) -> bytes:
+        if image.mode != "RGBA":
+            image = image.convert("RGBA")
+        digest = hashlib.sha256(struct.pack("<II", *image.size))
+        digest.update(image.tobytes())
+        return digest.digest()
+
 
 # -------------------------
-# Packing: simple shelf packer
+# Packing: shelf and MaxRects packers
 # -------------------------
 
 
@@ -167,6 +206,176 @@ class ShelfPacker:
         return (w, h)
 
 
+@dataclass
+class FreeRect:
+    x: int
+    y: int
+    w: int
+    h: int
+
+    def contains(self, other: "FreeRect") -> bool:
+        return (
+            self.x <= other.x
+            and self.y <= other.y
+            and self.x + self.w >= other.x + other.w
+            and self.y + self.h >= other.y + other.h
+        )
+
+
+class MaxRectsPacker:
+    """
+    MaxRects bin-packer using the best-short-side-fit heuristic:
+    - Keep a list of maximal free rectangles (they may overlap)
+    - Place each rect in the free rectangle where the shorter leftover side
+      is smallest (ties broken on the longer leftover side)
+    - Split every free rectangle the placed rect overlaps into up to four
+      new maximal ones, then drop any free rectangle contained in another
+    - The bin starts out empty and only grows downwards (up to max_h) when
+      nothing fits, otherwise best-short-side-fit happily scatters sprites
+      over the whole max_w x max_h area and the cropped sheet stays huge
+
+    Slower than ShelfPacker but packs mixed sizes much more tightly.
+    Same interface as ShelfPacker so build_spritesheet can use either.
+    """
+
+    def __init__(self, max_w: int, max_h: int, padding: int = 1):
+        self.max_w = max_w
+        self.max_h = max_h
+        self.padding = padding
+
+        # Each placed rect takes its size plus padding on the right / bottom,
+        # the sheet keeps padding on the top / left edge like ShelfPacker
+        self.bin_h = padding
+        self.free: List[FreeRect] = []
+
+        self.used_w = 0
+        self.used_h = 0
+        self.placements: List[Tuple[Rect, int, int]] = []
+
+    def _find_position(self, w: int, h: int) -> Optional[FreeRect]:
+        best: Optional[FreeRect] = None
+        best_score = (math.inf,)
+        for free in self.free:
+            if free.w >= w and free.h >= h:
+                leftover_w = free.w - w
+                leftover_h = free.h - h
+                # Ties go to the top-left-most spot so the used area stays
+                # compact and the cropped sheet stays small
+                score = (
+                    min(leftover_w, leftover_h),
+                    max(leftover_w, leftover_h),
+                    free.y,
+                    free.x,
+                )
+                if score < best_score:
+                    best = FreeRect(free.x, free.y, w, h)
+                    best_score = score
+        return best
+
+    def _split(self, used: FreeRect) -> List[FreeRect]:
+        # Replace every free rect overlapping `used` with the parts of it left over
+        kept: List[FreeRect] = []
+        created: List[FreeRect] = []
+        for free in self.free:
+            if (
+                used.x >= free.x + free.w
+                or used.x + used.w <= free.x
+                or used.y >= free.y + free.h
+                or used.y + used.h <= free.y
+            ):
+                kept.append(free)
+                continue
+
+            if used.x > free.x:
+                created.append(FreeRect(free.x, free.y, used.x - free.x, free.h))
+            if used.x + used.w < free.x + free.w:
+                right = used.x + used.w
+                created.append(
+                    FreeRect(right, free.y, free.x + free.w - right, free.h)
+                )
+            if used.y > free.y:
+                created.append(FreeRect(free.x, free.y, free.w, used.y - free.y))
+            if used.y + used.h < free.y + free.h:
+                bottom = used.y + used.h
+                created.append(
+                    FreeRect(free.x, bottom, free.w, free.y + free.h - bottom)
+                )
+        self.free = kept
+        return created
+
+    def _prune(self, created: List[FreeRect]):
+        # Only the new rects can contain or be contained by something, so
+        # they are the only ones that need checking against the full list
+        unique: List[FreeRect] = []
+        for i, new in enumerate(created):
+            if any(
+                other.contains(new) and (other != new or j < i)
+                for j, other in enumerate(created)
+                if j != i
+            ):
+                continue
+            if any(free.contains(new) for free in self.free):
+                continue
+            unique.append(new)
+
+        self.free = [
+            free
+            for free in self.free
+            if not any(new.contains(free) for new in unique)
+        ]
+        self.free.extend(unique)
+
+    def _grow(self, new_h: int):
+        # Free rects touching the current bottom edge extend down with it,
+        # and the new strip below is free across the whole width
+        grown = new_h - self.bin_h
+        for free in self.free:
+            if free.y + free.h == self.bin_h:
+                free.h += grown
+        strip = FreeRect(self.padding, self.bin_h, self.max_w - self.padding, grown)
+        self.bin_h = new_h
+        self._prune([strip])
+
+    def try_place(self, rect: Rect) -> bool:
+        pad = self.padding
+        w, h = rect.w + pad, rect.h + pad
+        if w > self.max_w - pad:
+            return False
+
+        spot = self._find_position(w, h)
+        if spot is None:
+            if self.bin_h + h > self.max_h:
+                return False
+            self._grow(self.bin_h + h)
+            spot = self._find_position(w, h)
+
+        self._prune(self._split(spot))
+        self.placements.append((rect, spot.x, spot.y))
+        self.used_w = max(self.used_w, spot.x + spot.w)
+        self.used_h = max(self.used_h, spot.y + spot.h)
+        return True
+
+    def dims_used(self) -> Tuple[int, int]:
+        w = max(1, min(self.max_w, self.used_w))
+        h = max(1, min(self.max_h, self.used_h))
+        return (w, h)
+
+
+PACKERS = {
+    "shelf": ShelfPacker,
+    "maxrects": MaxRectsPacker,
+}
+
+
+def packing_efficiency(packer) -> float:
+    """
+    Fraction of the output sheet covered by sprites (used / total area).
+    """
+    used_w, used_h = packer.dims_used()
+    used_area = sum(rect.w * rect.h for rect, _x, _y in packer.placements)
+    return used_area / (used_w * used_h)
+
+
 # -------------------------
 # Utility
 # -------------------------
@@ -191,12 +400,56 @@ def iter_pngs(input_dir: str, recursive: bool = False):
 def load_image_size(path: str) -> Tuple[int, int]:
     """
     Open an image to read its size with minimal cost.
+    Image.open only parses the header, the pixel data is never decoded.
     """
     with Image.open(path) as im:
-        im.load()  # Ensure header is read; still cheap for size
         return im.size
 
 
+def probe_image(path: str):
+    # (w, h) or the exception, so one bad file doesn't stop the pool
+    try:
+        return load_image_size(path)
+    except Exception as e:
+        return e
+
+
+def image_hash(path: str) -> str:
+    """
+    Hex pixel hash of an image file (imageDigest), so the same artwork saved
+    with different PNG settings still counts as identical.
+    """
+    with Image.open(path) as im:
+        return imageDigest(im).hex()
+
+
+def dedupe_rects(
+    rects: List[Rect], workers: Optional[int] = None
+) -> Tuple[List[Rect], Dict[str, List[str]]]:
+    """
+    Drop rects whose image is identical to an earlier one.
+
+    Returns:
+      - the unique rects, first occurrence of each image kept
+      - mapping of kept id -> ids of the duplicates dropped for it
+    """
+    first_by_hash: Dict[str, Rect] = {}
+    duplicates: Dict[str, List[str]] = {}
+    unique: List[Rect] = []
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        digests = list(pool.map(image_hash, [rect.path for rect in rects]))
+    for rect, digest in zip(rects, digests):
+        kept = first_by_hash.get(digest)
+        # Same hash but different size can't happen for the same pixels,
+        # but check anyway rather than silently misplace a sprite
+        if kept is not None and (kept.w, kept.h) == (rect.w, rect.h):
+            duplicates.setdefault(kept.id, []).append(rect.id)
+        else:
+            first_by_hash.setdefault(digest, rect)
+            unique.append(rect)
+    return unique, duplicates
+
+
 def natural_key(s: str) -> Tuple:
     """
     Sort keys 'naturally', attempting to place numeric filenames properly.
@@ -216,11 +469,81 @@ def write_json(path: str, data: dict):
         json.dump(data, f, ensure_ascii=False, indent=2)
 
 
-def save_png(
-    path: str, image: Image.Image, optimize: bool = True, compress_level: int = 9
-):
-    # Pillow 'optimize' can be CPU heavy but helps reduce file size
-    image.save(path, format="PNG", optimize=optimize, compress_level=compress_level)
+# name -> (file extension, Pillow format, save options)
+OUTPUT_FORMATS = {
+    "png-fast": ("png", "PNG", {"compress_level": 1}),
+    "png-balanced": ("png", "PNG", {"compress_level": 6}),
+    "png-max": ("png", "PNG", {"optimize": True, "compress_level": 9}),
+    # For lossless WebP, quality is compression effort, not image quality
+    "webp-fast": ("webp", "WEBP", {"lossless": True, "quality": 80, "method": 4}),
+    "webp-max": ("webp", "WEBP", {"lossless": True, "quality": 100, "method": 6}),
+}
+
+
+def to_indexed(image: Image.Image) -> Optional[Image.Image]:
+    """
+    Exact palette version of an RGBA image, or None if it has more than
+    256 distinct colours. No quantising, every pixel keeps its RGBA value.
+    """
+    try:
+        import numpy as np
+    except Exception as e:
+        raise SystemExit(
+            f"NumPy is required for --indexed. Install it with: pip install numpy\nImport error: {e}"
+        )
+
+    pixels = np.ascontiguousarray(np.asarray(image, dtype=np.uint8))
+    packed = pixels.view(np.uint32).reshape(-1)
+    colours, indices = np.unique(packed, return_inverse=True)
+    if len(colours) > 256:
+        return None
+
+    indexed = Image.fromarray(
+        indices.astype(np.uint8).reshape(image.height, image.width), mode="P"
+    )
+    indexed.putpalette(colours.view(np.uint8).tobytes(), rawmode="RGBA")
+    return indexed
+
+
+def encode_sheet(
+    path: str, image: Image.Image, output_format: str, indexed: bool = False
+) -> Tuple[float, int, bool]:
+    """
+    Save a sheet in one of OUTPUT_FORMATS.
+
+    Returns (encode seconds, file size in bytes, whether it was saved indexed).
+    """
+    _ext, pil_format, options = OUTPUT_FORMATS[output_format]
+    start = time.perf_counter()
+    # Lossless WebP has no palette mode of its own, Pillow would just
+    # expand it back to RGBA
+    palette = to_indexed(image) if indexed and pil_format == "PNG" else None
+    (palette or image).save(path, format=pil_format, **options)
+    return time.perf_counter() - start, os.path.getsize(path), palette is not None
+
+
+def compose_sheet(
+    sheet_path: str,
+    size: Tuple[int, int],
+    bg_rgba: tuple,
+    placements: List[Tuple[str, int, int]],
+    output_format: str = "png-max",
+    indexed: bool = False,
+) -> Tuple[float, int, bool]:
+    """
+    Paste (path, x, y) placements onto a new sheet and save it, returns
+    encode_sheet's (seconds, bytes, indexed).
+    Top level so it can run in a worker process, one sheet per call.
+    """
+    sheet = Image.new("RGBA", size, color=bg_rgba)
+    for path, x, y in placements:
+        # Open and paste
+        with Image.open(path) as im:
+            if im.mode != "RGBA":
+                im = im.convert("RGBA")
+            sheet.paste(im, (x, y))
+
+    return encode_sheet(sheet_path, sheet, output_format, indexed)
 
 
 # -------------------------
@@ -237,6 +560,11 @@ def build_spritesheet(
     bg_color: str,
     single_sheet: bool,
     recursive: bool,
+    packer_name: str = "shelf",
+    dedupe: bool = True,
+    workers: Optional[int] = None,
+    output_format: str = "png-max",
+    indexed: bool = False,
 ) -> Tuple[List[str], Dict[str, dict]]:
     """
     Returns:
@@ -248,29 +576,43 @@ def build_spritesheet(
     if not files:
         raise RuntimeError(f"No .png files found in {input_dir}")
 
-    # Parse rects: read sizes (lazy, only headers)
+    # Parse rects: read sizes (lazy, only headers), the scan is I/O bound
+    # so it runs on threads
+    files.sort(key=lambda x: natural_key(x[1]))
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        sizes = list(pool.map(probe_image, [abspath for abspath, _ in files]))
+
     rects: List[Rect] = []
-    for abspath, filename in sorted(files, key=lambda x: natural_key(x[1])):
+    for (abspath, filename), size in zip(files, sizes):
         stem = os.path.splitext(filename)[0]
-        try:
-            w, h = load_image_size(abspath)
-        except Exception as e:
-            print(f"[WARN] Skipping {filename}: cannot read size ({e})")
+        if isinstance(size, Exception):
+            print(f"[WARN] Skipping {filename}: cannot read size ({size})")
             continue
+        w, h = size
         rects.append(Rect(id=stem, path=abspath, w=w, h=h))
 
     if not rects:
         raise RuntimeError("No readable PNGs found to pack.")
 
+    # Pack each distinct image once
+    duplicates: Dict[str, List[str]] = {}
+    if dedupe:
+        rects, duplicates = dedupe_rects(rects, workers)
+        dropped = sum(len(ids) for ids in duplicates.values())
+        print(
+            f"[INFO] Dedupe: {len(rects)} unique images, {dropped} duplicates share their rects"
+        )
+
     # Sort rects by height desc, then width desc for better packing
     rects.sort(key=lambda r: (-r.h, -r.w, natural_key(r.id)))
 
     # Attempt to pack into sheets
+    packer_cls = PACKERS[packer_name]
     sheet_index = 0
     all_placements: List[Placed] = []
-    sheet_packers: List[ShelfPacker] = []
+    sheet_packers: list = []
 
-    current = ShelfPacker(max_size, max_size, padding)
+    current = packer_cls(max_size, max_size, padding)
     sheet_packers.append(current)
 
     for r in rects:
@@ -283,7 +625,7 @@ def build_spritesheet(
                 )
             # Create next sheet and place
             sheet_index += 1
-            current = ShelfPacker(max_size, max_size, padding)
+            current = packer_cls(max_size, max_size, padding)
             sheet_packers.append(current)
             ok2 = current.try_place(r)
             if not ok2:
@@ -316,27 +658,20 @@ def build_spritesheet(
     else:
         raise ValueError("Invalid --background color. Use #RRGGBB or #RRGGBBAA.")
 
+    jobs = []
     for idx, packer in enumerate(sheet_packers):
-        used_w, used_h = packer.dims_used()
         # Create minimal sized sheet for used area
-        sheet = Image.new("RGBA", (used_w, used_h), color=bg_rgba)
+        used_w, used_h = packer.dims_used()
 
         # Determine file name
+        ext = OUTPUT_FORMATS[output_format][0]
         if len(sheet_packers) == 1:
-            sheet_name = f"{basename}.png"
+            sheet_name = f"{basename}.{ext}"
         else:
-            sheet_name = f"{basename}_{idx}.png"
+            sheet_name = f"{basename}_{idx}.{ext}"
         sheet_path = os.path.join(out_dir, sheet_name)
 
-        # Paste sprites
-        # Iterate over placements in this packer
         for rect, x, y in packer.placements:
-            # Open and paste
-            with Image.open(rect.path) as im:
-                if im.mode != "RGBA":
-                    im = im.convert("RGBA")
-                sheet.paste(im, (x, y))
-
             # Save meta
             id_to_meta[rect.id] = {
                 "sheet": sheet_name,
@@ -345,13 +680,36 @@ def build_spritesheet(
                 "w": rect.w,
                 "h": rect.h,
             }
+            for duplicate_id in duplicates.get(rect.id, ()):
+                id_to_meta[duplicate_id] = id_to_meta[rect.id]
 
-        # Save the sheet
-        save_png(sheet_path, sheet, optimize=True, compress_level=9)
         sheet_files.append(sheet_name)
+        placements = [(rect.path, x, y) for rect, x, y in packer.placements]
+        jobs.append(
+            (sheet_path, (used_w, used_h), bg_rgba, placements, output_format, indexed)
+        )
+
+    # Sheets are independent, so with more than one they are pasted and
+    # encoded in parallel
+    if len(jobs) > 1 and (workers is None or workers > 1):
+        with ProcessPoolExecutor(max_workers=workers) as pool:
+            results = list(pool.map(compose_sheet, *zip(*jobs)))
+    else:
+        results = [compose_sheet(*job) for job in jobs]
+
+    total_bytes = 0
+    for packer, job, (seconds, size_bytes, was_indexed) in zip(sheet_packers, jobs, results):
+        sheet_path, (used_w, used_h) = job[0], job[1]
+        total_bytes += size_bytes
+        print(
+            f"[OK] Wrote sheet: {sheet_path} ({used_w}x{used_h}) with {len(packer.placements)} sprites, "
+            f"{packing_efficiency(packer):.1%} packed"
+        )
         print(
-            f"[OK] Wrote sheet: {sheet_path} ({used_w}x{used_h}) with {len(packer.placements)} sprites"
+            f"     {output_format}{' indexed' if was_indexed else ''}: "
+            f"{size_bytes:,} bytes, encoded in {seconds:.2f}s"
         )
+    print(f"[INFO] Total sheet size: {total_bytes:,} bytes ({output_format})")
 
     return sheet_files, id_to_meta
 
@@ -401,6 +759,34 @@ def main():
         action="store_true",
         help="Fail if sprites cannot fit into one sheet (default: allows multiple sheets)",
     )
+    parser.add_argument(
+        "--packer",
+        choices=sorted(PACKERS),
+        default="shelf",
+        help="Packing algorithm: shelf (fast) or maxrects (tighter, best-short-side-fit) (default: shelf)",
+    )
+    parser.add_argument(
+        "--no-dedupe",
+        action="store_true",
+        help="Pack identical images separately instead of sharing one rect (default: dedupe)",
+    )
+    parser.add_argument(
+        "--workers",
+        type=int,
+        default=None,
+        help="Threads for the scan and processes for composing sheets (default: CPU count)",
+    )
+    parser.add_argument(
+        "--format",
+        choices=list(OUTPUT_FORMATS),
+        default="png-max",
+        help="Sheet encoding: png-fast, png-balanced, png-max, webp-fast or webp-max (lossless) (default: png-max)",
+    )
+    parser.add_argument(
+        "--indexed",
+        action="store_true",
+        help="Save sheets with <= 256 colours as exact palette images (needs NumPy)",
+    )
     parser.add_argument(
         "--recursive",
         action="store_true",
@@ -423,6 +809,7 @@ def main():
     print(
         f"[INFO] Background: {args.background} | Single sheet: {args.single_sheet} | Recursive: {args.recursive}"
     )
+    print(f"[INFO] Packer: {args.packer}")
 
     sheets, sprites = build_spritesheet(
         input_dir=input_dir,
@@ -433,6 +820,11 @@ def main():
         bg_color=args.background,
         single_sheet=args.single_sheet,
         recursive=args.recursive,
+        packer_name=args.packer,
+        dedupe=not args.no_dedupe,
+        workers=args.workers,
+        output_format=args.format,
+        indexed=args.indexed,
     )
 
     meta = {
@@ -441,6 +833,9 @@ def main():
         "input": input_dir,
         "padding": args.padding,
         "max_size": args.max_size,
+        "packer": args.packer,
+        "dedupe": not args.no_dedupe,
+        "format": args.format,
         "sheet_count": len(sheets),
         "sheets": [],
     }
@@ -0,0 +1,312 @@
+import numpy as np
+
+'''
+Bulk extraction of the sprite data in spritesheetf into NumPy structured arrays
+
+The generated accessors (Sprite.Position(), MaskPosition(), Color() ...) allocate a wrapper object and re-import the
+struct module on every call, across tens of thousands of sprites that is millions of tiny allocations. The Sprite
+tables are simple enough to read directly though - every table starts with an offset to its vtable, the vtable gives
+the offset of each field and the Position / Color structs are stored inline. Doing that for every sprite at once with
+NumPy fancy indexing means one pass over the vector, after which JSON export and size filtering are array operations.
+
+Field slots follow sprites.fbs, if the schema changes these need to change with it.
+'''
+
+# Sprite table field slots, as ordered in sprites.fbs
+SPRITE_POSITION = 0
+SPRITE_MASK_POSITION = 1
+SPRITE_PADDING = 2
+SPRITE_INDEX = 3
+SPRITE_COLOR = 4
+SPRITE_IS_TRANSPARENT = 5
+SPRITE_NAME = 6
+SPRITE_ATLAS_ID = 7
+
+# AnimatedSpriteSheet table field slots
+ANIMATED_NAME = 0
+ANIMATED_INDEX = 1
+ANIMATED_SET = 2
+ANIMATED_DIRECTION = 3
+ANIMATED_ACTION = 4
+ANIMATED_SPRITE = 5
+
+# sheet - position of the sheet in the root sprites vector
+# index - position of the sprite within its sheet, this is the index buildSpritesheetJson has always written
+# spriteIndex - the Index field stored on the sprite itself
+# mask - mask position as x, y, w, h
+SPRITE_DTYPE = np.dtype([
+	("sheet", "<i4"),
+	("index", "<i4"),
+	("spriteIndex", "<i4"),
+	("x", "<f4"),
+	("y", "<f4"),
+	("w", "<f4"),
+	("h", "<f4"),
+	("mask", "<f4", (4,)),
+	("rgba", "<f4", (4,)),
+	("transparent", "?"),
+	("atlasId", "<u8"),
+])
+
+ANIMATED_DTYPE = np.dtype([
+	("index", "<u4"),
+	("set", "<i4"),
+	("direction", "<u4"),
+	("action", "<u4"),
+])
+
+
+def _read(buf, positions, dtype, count=1):
+	# reads `count` little endian values of dtype at every position, returns shape (n,) or (n, count)
+	dtype = np.dtype(dtype)
+	positions = np.asarray(positions, dtype=np.int64)
+	raw = buf[positions[:, None] + np.arange(dtype.itemsize * count)]
+	values = raw.view(dtype)
+	return values[:, 0] if count == 1 else values
+
+
+def _vectorTables(buf, vector_start, length):
+	# positions of the tables referenced by a vector of offsets
+	elements = vector_start + 4 * np.arange(length, dtype=np.int64)
+	return elements + _read(buf, elements, "<u4")
+
+
+def _fieldPositions(buf, tables, slot):
+	"""
+	absolute position of field `slot` in every table, 0 where the field isn't present
+
+	missing fields are either past the end of the vtable or have an offset of 0, both mean "use the default"
+	"""
+	vtables = tables - _read(buf, tables, "<i4")
+	vtableLength = _read(buf, vtables, "<u2")
+	entry = 4 + 2 * slot
+	present = entry < vtableLength
+	offsets = _read(buf, np.where(present, vtables + entry, vtables), "<u2")
+	return np.where(present & (offsets != 0), tables + offsets, 0)
+
+
+def _readField(buf, fieldPositions, dtype, count=1, default=0):
+	present = fieldPositions != 0
+	values = _read(buf, np.where(present, fieldPositions, 0), dtype, count)
+	if count == 1:
+		return np.where(present, values, default)
+	return np.where(present[:, None], values, default)
+
+
+def _readStrings(data, buf, fieldPositions):
+	# decodes the strings a string field points at, the only per sprite Python work
+	present = fieldPositions != 0
+	strings = np.where(present, fieldPositions, 0)
+	strings = strings + _read(buf, strings, "<u4")
+	lengths = _read(buf, strings, "<u4")
+	return [
+		bytes(data[start + 4:start + 4 + length]).decode("utf-8") if isPresent else ""
+		for start, length, isPresent in zip(strings.tolist(), lengths.tolist(), present.tolist())
+	]
+
+
+def _spriteRecords(data, buf, tables):
+	# decodes every Sprite table at `tables` into a SPRITE_DTYPE array (sheet / index left at 0) and its names
+	sprites = np.zeros(len(tables), dtype=SPRITE_DTYPE)
+	if not len(tables):
+		return sprites, []
+
+	# Position is X, Y, H, W in the schema
+	position = _readField(buf, _fieldPositions(buf, tables, SPRITE_POSITION), "<f4", 4, 0.0)
+	sprites["x"], sprites["y"], sprites["h"], sprites["w"] = position.T
+	mask = _readField(buf, _fieldPositions(buf, tables, SPRITE_MASK_POSITION), "<f4", 4, 0.0)
+	sprites["mask"] = mask[:, [0, 1, 3, 2]]
+	sprites["rgba"] = _readField(buf, _fieldPositions(buf, tables, SPRITE_COLOR), "<f4", 4, 0.0)
+	sprites["spriteIndex"] = _readField(buf, _fieldPositions(buf, tables, SPRITE_INDEX), "<i4")
+	sprites["transparent"] = _readField(buf, _fieldPositions(buf, tables, SPRITE_IS_TRANSPARENT), "u1") != 0
+	sprites["atlasId"] = _readField(buf, _fieldPositions(buf, tables, SPRITE_ATLAS_ID), "<u8")
+
+	return sprites, _readStrings(data, buf, _fieldPositions(buf, tables, SPRITE_NAME))
+
+
+class SpriteArrays:
+	"""
+	every sprite of the selected sheets as one structured array (see SPRITE_DTYPE) plus parallel name lists
+
+	:var	sprites: SPRITE_DTYPE array, ordered by sheet then position in the sheet
+	:var	names: sprite name per entry in sprites
+	:var	sheetNames / sheetAtlasIds: per sheet, indexed by sprites["sheet"]
+	"""
+
+	def __init__(self, sprites, names, sheet_names, sheet_atlas_ids):
+		self.sprites = sprites
+		self.names = names
+		self.sheetNames = sheet_names
+		self.sheetAtlasIds = sheet_atlas_ids
+
+	def __len__(self):
+		return len(self.sprites)
+
+
+def extractSpriteArrays(sprite_sheet_root, allowed_sheet_names=None):
+	"""
+	reads every sprite of every sheet (optionally only allowed_sheet_names) in one go
+
+	the sheets themselves are walked with the generated accessors, there are only a few hundred of them, the sprites
+	in them are all decoded together
+	"""
+	data = sprite_sheet_root._tab.Bytes
+	buf = np.frombuffer(data, dtype=np.uint8)
+
+	sheetNames = []
+	sheetAtlasIds = []
+	tables = []
+	sheetColumn = []
+	indexColumn = []
+
+	for i in range(sprite_sheet_root.SpritesLength()):
+		sheet = sprite_sheet_root.Sprites(i)
+		sheet_name = sheet.Name().decode("utf-8")
+
+		if allowed_sheet_names is not None and sheet_name not in allowed_sheet_names:
+			continue
+
+		# sheet.Sprites vector, slot 2 of SpriteSheet
+		vector = sheet._tab.Offset(8)
+		length = sheet._tab.VectorLen(vector) if vector else 0
+
+		sheetNumber = len(sheetNames)
+		sheetNames.append(sheet_name)
+		sheetAtlasIds.append(sheet.AtlasId())
+		if length:
+			tables.append(_vectorTables(buf, sheet._tab.Vector(vector), length))
+			sheetColumn.append(np.full(length, sheetNumber, dtype=np.int32))
+			indexColumn.append(np.arange(length, dtype=np.int32))
+
+	if not tables:
+		return SpriteArrays(np.zeros(0, dtype=SPRITE_DTYPE), [], sheetNames, sheetAtlasIds)
+
+	sprites, names = _spriteRecords(data, buf, np.concatenate(tables))
+	sprites["sheet"] = np.concatenate(sheetColumn)
+	sprites["index"] = np.concatenate(indexColumn)
+	return SpriteArrays(sprites, names, sheetNames, sheetAtlasIds)
+
+
+def extractAnimatedSpriteArrays(sprite_sheet_root):
+	"""
+	reads every animated sprite in one go
+
+	:returns: (ANIMATED_DTYPE array, animation names, SPRITE_DTYPE array of the sprite each one uses, sprite names)
+	"""
+	data = sprite_sheet_root._tab.Bytes
+	buf = np.frombuffer(data, dtype=np.uint8)
+
+	# SpriteSheetRoot.animated_sprites vector, slot 1
+	vector = sprite_sheet_root._tab.Offset(6)
+	length = sprite_sheet_root._tab.VectorLen(vector) if vector else 0
+	if not length:
+		return np.zeros(0, dtype=ANIMATED_DTYPE), [], np.zeros(0, dtype=SPRITE_DTYPE), []
+
+	tables = _vectorTables(buf, sprite_sheet_root._tab.Vector(vector), length)
+
+	animated = np.zeros(length, dtype=ANIMATED_DTYPE)
+	animated["index"] = _readField(buf, _fieldPositions(buf, tables, ANIMATED_INDEX), "<u4")
+	animated["set"] = _readField(buf, _fieldPositions(buf, tables, ANIMATED_SET), "<i4")
+	animated["direction"] = _readField(buf, _fieldPositions(buf, tables, ANIMATED_DIRECTION), "<u4")
+	animated["action"] = _readField(buf, _fieldPositions(buf, tables, ANIMATED_ACTION), "<u4")
+	names = _readStrings(data, buf, _fieldPositions(buf, tables, ANIMATED_NAME))
+
+	# every animated sprite is expected to have its sprite table, the same as spriteToDict(anim.Sprite()) assumes
+	spriteFields = _fieldPositions(buf, tables, ANIMATED_SPRITE)
+	spriteTables = spriteFields + _read(buf, spriteFields, "<u4")
+	sprites, spriteNames = _spriteRecords(data, buf, spriteTables)
+	sprites["index"] = np.arange(length, dtype=np.int32)
+
+	return animated, names, sprites, spriteNames
+
+
+def spriteRecordToDict(sprite):
+	# one SPRITE_DTYPE record in the same layout spriteToDict has always written to spritesheet.json
+	return {
+		"position": [float(sprite["x"]), float(sprite["y"]), float(sprite["h"]), float(sprite["w"])],
+		"mask_position": sprite["mask"].tolist(),
+		"color": sprite["rgba"].tolist(),
+		"transparent": bool(sprite["transparent"]),
+	}
+
+
+'''
+Size filters
+
+A filter is any callable taking (sprites, sheet_names) and returning a boolean array, one entry per sprite, so a
+filter is evaluated over every sprite in one step. They can be combined with anyOf / allOf and applied per sheet with
+perSheet, e.g. 8x8 everywhere but 16x16 as well on the 16x16 sheets:
+
+	anyOf(sizeIn((8, 8)), perSheet({"iceCitadelObjects16x16": sizeIn((16, 16))}))
+'''
+
+
+def sizeIn(*sizes):
+	# sprites whose (w, h) is exactly one of sizes
+	def sizeFilter(sprites, sheet_names):
+		keep = np.zeros(len(sprites), dtype=bool)
+		for w, h in sizes:
+			keep |= (sprites["w"] == w) & (sprites["h"] == h)
+		return keep
+	return sizeFilter
+
+
+def sizeBetween(min_size, max_size):
+	# sprites whose width and height are both within (min_w, min_h) - (max_w, max_h) inclusive
+	def sizeFilter(sprites, sheet_names):
+		return (
+			(sprites["w"] >= min_size[0]) & (sprites["w"] <= max_size[0])
+			& (sprites["h"] >= min_size[1]) & (sprites["h"] <= max_size[1])
+		)
+	return sizeFilter
+
+
+def anyOf(*filters):
+	def combined(sprites, sheet_names):
+		keep = np.zeros(len(sprites), dtype=bool)
+		for spriteFilter in filters:
+			keep |= spriteFilter(sprites, sheet_names)
+		return keep
+	return combined
+
+
+def allOf(*filters):
+	def combined(sprites, sheet_names):
+		keep = np.ones(len(sprites), dtype=bool)
+		for spriteFilter in filters:
+			keep &= spriteFilter(sprites, sheet_names)
+		return keep
+	return combined
+
+
+def perSheet(rules, default=None):
+	"""
+	applies a different filter per sheet name, sheets not in rules use default (or are dropped if there is none)
+
+	the sheets a rule covers are picked out with one isin over sprites["sheet"]
+	"""
+	def combined(sprites, sheet_names):
+		keep = np.zeros(len(sprites), dtype=bool)
+		covered = np.zeros(len(sprites), dtype=bool)
+		for sheet_name, spriteFilter in rules.items():
+			numbers = [number for number, name in enumerate(sheet_names) if name == sheet_name]
+			onSheet = np.isin(sprites["sheet"], numbers)
+			keep |= onSheet & spriteFilter(sprites, sheet_names)
+			covered |= onSheet
+		if default is not None:
+			keep |= ~covered & default(sprites, sheet_names)
+		return keep
+	return combined
+
+
+def parseSizes(sizes):
+	# "8x8,16x16" -> sizeIn((8, 8), (16, 16))
+	return sizeIn(*(
+		tuple(float(value) for value in size.lower().split("x"))
+		for size in sizes.split(",") if size.strip()
+	))
+
+
+def selectSprites(sprites, size_filter, sheet_names=()):
+	# indices of the sprites the filter keeps, in their original order
+	return np.flatnonzero(size_filter(sprites, list(sheet_names)))
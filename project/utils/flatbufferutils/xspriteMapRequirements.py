@@ -1,8 +1,8 @@
 import json
-from collections import Counter
-import xml.etree.ElementTree as ET
 import os
 
+from RotMGCalc.project.utils.xmlStreaming import iterObjects
+
 '''
 This script is meant to read the XML files extracted from the game so that you are able to identify which
 corresponding spritesheets are required for a given sprite. This allows you to cut down the amount of data stored
@@ -16,27 +16,13 @@ wish to include things like dungeon sprites or bullet sprites.
 INPUT_XML = os.environ.get("INPUT_XML")
 
 def spriteSheetCounter(input_xml):
-	tree = ET.parse(input_xml)
-	root = tree.getroot()
-
 	# we only want these sprites, so only the tags with these labels will be exported, thus reducing data
 	labels_required = {"ARMOR", "WEAPON", "RING", "ABILITY"}
-	file_tags = []
-
-	for obj in root.findall(".//Object"):
-		labels = obj.find("Labels")
-		if labels is None:
-			continue
-
-		label_list = {lbl.strip().upper() for lbl in labels.text.split(",")}
-		if not (label_list & labels_required):
-			continue
 
-		texture_file = obj.find(".//Texture/File")
-		if texture_file is not None and texture_file.text:
-			file_tags.append(texture_file.text)
+	# only the set of files is needed, so nothing else from each object is held onto
+	file_tags = {obj["File"] for obj in iterObjects(input_xml, labels_required)}
 
-	tagSet = sorted(set(file_tags))
+	tagSet = sorted(file_tags)
 
 	json.dump(tagSet, open("spriteMapRequirements.json", "w"), indent=2)
 
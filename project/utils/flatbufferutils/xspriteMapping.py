@@ -1,13 +1,24 @@
 import json
-from sys import exception
+import mmap
 import os
 from collections import defaultdict
+
+import numpy as np
+
 import SpriteSheetRoot
+from RotMGCalc.project.utils.spriteAtlas import writeSpriteAtlas
+from xspriteArrays import (
+	extractAnimatedSpriteArrays, extractSpriteArrays, parseSizes, selectSprites, spriteRecordToDict,
+)
 
 # spritesheetf.bin file extracted from game file
 SPRITE_SHEET_BIN = os.environ.get('SPRITE_SHEET_BIN')
 # spriteMapRequirements.json file
 SPRITE_MAP_REQUIREMENTS = "spriteMapRequirements.json"
+# binary atlas index written alongside spritesheet.json, see spriteAtlas.py
+SPRITE_ATLAS = os.environ.get('SPRITE_ATLAS', '../spriteatlas.bin')
+# sprite sizes to export, comma separated WxH - e.g. "8x8,16x16". equipment sprites are all 8x8
+SPRITE_SIZES = os.environ.get('SPRITE_SIZES', '8x8')
 
 '''
 This module considers the use of flatc (https://flatbuffers.dev/) to decode the binary file
@@ -26,6 +37,7 @@ changes in future you won't be able to decode the spritesheef file as the exact
 
 
 # read binary file for spritesheet and return a dictionary containing the sprite data
+# this goes through the generated accessors one sprite at a time, for whole sheets use xspriteArrays instead
 def spriteToDict(sprite):
 	# these are the functions from the decoded Schema
 	position = sprite.Position()
@@ -41,64 +53,100 @@ def spriteToDict(sprite):
 	}
 
 
-def buildSpritesheetJson(sprite_sheet, allowed_sheet_names=None):
-	# builds the json with all the required sprites
-	result = []
-	for i in range(sprite_sheet.SpritesLength()):
-		sheet = sprite_sheet.Sprites(i)
-		sheet_name = sheet.Name().decode("utf-8")
-
-		if allowed_sheet_names is not None and sheet_name not in allowed_sheet_names:
-			continue
-
-		sprite_info = defaultdict(list)
-		sprite_indices = defaultdict(list)
-
-		# this value is just for logging purposes - it does not correspond to the XML or any gamefile value
-		index_counter = 0
-
-		for j in range(sheet.SpritesLength()):
-			sprite = sheet.Sprites(j)
-
-			current_index = index_counter
-			index_counter += 1
-
-			# specify what sprite width and height you want to export
-			if not widthHeightParsing(sprite, requiredWidthHeight=(8.0, 8.0)):
-				continue
-
-			current_sprite = sprite.Name().decode("utf-8")
-			sprite_info[current_sprite].append(spriteToDict(sprite))
-			sprite_indices[current_sprite].append(current_index)
+def spritesheetJsonFromArrays(sprite_arrays, selected):
+	"""
+	builds the spritesheets part of spritesheet.json from pre-extracted sprite arrays (see xspriteArrays)
+
+	:arg	sprite_arrays: SpriteArrays from extractSpriteArrays
+	:arg	selected: indices into sprite_arrays.sprites to export, every sheet is written even if none are selected
+	"""
+	sprites = sprite_arrays.sprites[selected]
+	names = [sprite_arrays.names[i] for i in np.asarray(selected).tolist()]
+
+	# columns to plain python lists in one go rather than a conversion per value
+	positions = np.stack([sprites["x"], sprites["y"], sprites["h"], sprites["w"]], axis=1).tolist()
+	masks = sprites["mask"].tolist()
+	colors = sprites["rgba"].tolist()
+	transparent = sprites["transparent"].tolist()
+	# this value is just for logging purposes - it does not correspond to the XML or any gamefile value
+	indices = sprites["index"].tolist()
+
+	sprite_info = [defaultdict(list) for _ in sprite_arrays.sheetNames]
+	for row, sheet in enumerate(sprites["sheet"].tolist()):
+		sprite_info[sheet][names[row]].append({
+			"position": positions[row],
+			"mask_position": masks[row],
+			"color": colors[row],
+			"transparent": transparent[row],
+			"index": indices[row],
+		})
 
-		result.append({
+	return [
+		{
 			"name": sheet_name,
-			"atlasId": sheet.AtlasId(),
+			"atlasId": atlas_id,
 			"sprites": [
-				{
-					"name": name,
-					"spriteLocation": [
-						{**frame, "index": idx}
-						for frame, idx in zip(frames, sprite_indices[name])
-					]
-				}
-				for name, frames in sprite_info.items()
+				{"name": name, "spriteLocation": frames}
+				for name, frames in sprite_info[sheet].items()
 			]
-		})
-
-	return result
-
+		}
+		for sheet, (sheet_name, atlas_id) in enumerate(zip(sprite_arrays.sheetNames, sprite_arrays.sheetAtlasIds))
+	]
+
+
+def buildSpritesheetJson(sprite_sheet, allowed_sheet_names=None, size_filter=None, sprite_arrays=None):
+	"""
+	builds the json with all the required sprites
+
+	:arg	size_filter: which sprites to export (see the size filters in xspriteArrays), defaults to SPRITE_SIZES
+	:arg	sprite_arrays: already extracted SpriteArrays, pass these in to export several filters from one decode
+	"""
+	if sprite_arrays is None:
+		sprite_arrays = extractSpriteArrays(sprite_sheet, allowed_sheet_names)
+
+	# specify what sprite width and height you want to export
+	size_filter = size_filter or parseSizes(SPRITE_SIZES)
+	selected = selectSprites(sprite_arrays.sprites, size_filter, sprite_arrays.sheetNames)
+	return spritesheetJsonFromArrays(sprite_arrays, selected)
+
+
+def buildAnimatedSpritesJson(sprite_sheet, size_filter=None, animated_arrays=None):
+	# builds the animated_sprites part of the json, filtered the same way as buildSpritesheetJson
+	if animated_arrays is None:
+		animated_arrays = extractAnimatedSpriteArrays(sprite_sheet)
+	animated, names, sprites, _ = animated_arrays
+
+	# specify what sprite width and height you want to export
+	size_filter = size_filter or parseSizes(SPRITE_SIZES)
+	selected = selectSprites(sprites, size_filter).tolist()
+	return [
+		{
+			"name": names[i],
+			"index": int(animated[i]["index"]),
+			"set": int(animated[i]["set"]),
+			"direction": int(animated[i]["direction"]),
+			"action": int(animated[i]["action"]),
+			"sprite": spriteRecordToDict(sprites[i])
+		}
+		for i in selected
+	]
 
 
 def loadSpritesheet(sprite_file_path):
+	"""
+	memory maps the spritesheetf binary and decodes straight from the mapping
+
+	nothing is copied, the flatbuffer accessors read the mapped pages, so several worker processes loading the same
+	file share the one page cached copy instead of each holding their own multi MB duplicate. the mapping stays open
+	for as long as the returned root (or anything decoded from it) is referenced
+	"""
 	try:
 		with open(sprite_file_path, "rb") as f:
-			data = f.read()
+			buffer = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
 
-		buffer = bytearray(data)
-		sprite_sheet_root = SpriteSheetRoot.SpriteSheetRoot.GetRootAsSpriteSheetRoot(buffer, 0)
+		sprite_sheet_root = SpriteSheetRoot.SpriteSheetRoot.GetRootAs(buffer, 0)
 		return sprite_sheet_root
-	except exception as error:
+	except (OSError, ValueError) as error:
 		print(f"Unable to find file path or failure to read file data, please validate file path and or the decoded "
 		      f"Schema files - see exception - {error}")
 
@@ -112,15 +160,6 @@ def loadSpriteMapRequirements(sprite_requirements):
 	except:
 		print("No spriteMapRequirements.json found, exporting all sprites")
 
-''' 
-this function allows you to parse the sprites by their width and height, which allows us to specifically export the 
-sprites for gear in the game.
-'''
-def widthHeightParsing(sprite, requiredWidthHeight=(None, None)):
-	position = sprite.Position()
-	return position.W() == requiredWidthHeight[0] and position.H() == requiredWidthHeight[1]
-
-
 
 if __name__ == "__main__":
 
@@ -128,23 +167,20 @@ if __name__ == "__main__":
 	# load optional specified spritesheets
 	spriteMapSet = loadSpriteMapRequirements(SPRITE_MAP_REQUIREMENTS)
 
+	# decoded once, both the atlas index and the json are written from these
+	sprite_arrays = extractSpriteArrays(sprite_sheet, spriteMapSet)
+	selected = selectSprites(sprite_arrays.sprites, parseSizes(SPRITE_SIZES), sprite_arrays.sheetNames)
+
+	# binary atlas index, this is what spriteExtractor reads
+	writeSpriteAtlas(SPRITE_ATLAS, sprite_arrays.sheetNames, sprite_arrays.sheetAtlasIds,
+	                 sprite_arrays.sprites[selected], [sprite_arrays.names[i] for i in selected.tolist()])
+
 	# returns a dictionary with all necessary values to map each sprite on the spritesheet
 	sprite_sheet_dict = {
-		"spritesheets": buildSpritesheetJson(sprite_sheet, spriteMapSet),
-		"animated_sprites": [
-			{
-				"name": (anim := sprite_sheet.AnimatedSprites(i)).Name().decode("utf-8"),
-				"index": anim.Index(),
-				"set": anim.Set(),
-				"direction": anim.Direction(),
-				"action": anim.Action(),
-				"sprite": spriteToDict(anim.Sprite())
-			}
-			for i in range(sprite_sheet.AnimatedSpritesLength())
-			# specify what sprite width and height you want to export
-			if widthHeightParsing(sprite_sheet.AnimatedSprites(i).Sprite(), requiredWidthHeight=(8.0, 8.0))
-		]
+		"spritesheets": spritesheetJsonFromArrays(sprite_arrays, selected),
+		"animated_sprites": buildAnimatedSpritesJson(sprite_sheet)
 	}
 
-with open("../spritesheet.json", "w") as f:
-	json.dump(sprite_sheet_dict, f, indent=2)
+	# compact, the json is only kept for the animated sprites and for reading by hand
+	with open("../spritesheet.json", "w") as f:
+		json.dump(sprite_sheet_dict, f, separators=(",", ":"))
@@ -0,0 +1,153 @@
+import os
+
+from PIL import Image
+
+from RotMGCalc.project.utils.unusedSpriteToBinary import iterSpriteFiles
+
+"""
+Perceptual hashes and a BK-tree over them, for finding which completed sprite a new one is a recolor / reskin of
+
+The pixel hash in unusedSpriteToBinary only matches identical sprites, a recolored or slightly edited sprite gets a
+completely different hash. A perceptual hash is 64 bits describing the rough look of the sprite, so similar sprites
+are a few bits apart
+	averageHash - 8x8 brightness, each bit is whether that pixel is brighter than the mean
+	differenceHash - 9x8 brightness, each bit is whether a pixel is brighter than the one to its right, this follows
+	the shape and shading rather than the colours so it is the better one for recolors
+	shapeHash - 8x8 alpha, each bit is whether that pixel is opaque, a pure recolor keeps exactly the same shape hash
+
+Sprites are composited onto black first so fully transparent pixels all look the same whatever colour they hold.
+
+The BK-tree is keyed on hamming distance, a lookup only walks the branches which can hold something within the given
+distance, so finding near duplicates among thousands of completed sprites doesn't compare against all of them.
+"""
+
+HASH_SIZE = 8
+
+
+def _greyscale(image, size):
+	image = image.convert("RGBA")
+	background = Image.new("RGBA", image.size, (0, 0, 0, 255))
+	return Image.alpha_composite(background, image).convert("L").resize(size, Image.BILINEAR)
+
+
+def _bits(values):
+	hashValue = 0
+	for value in values:
+		hashValue = (hashValue << 1) | bool(value)
+	return hashValue
+
+
+def averageHash(image):
+	pixels = _greyscale(image, (HASH_SIZE, HASH_SIZE)).tobytes()
+	mean = sum(pixels) / len(pixels)
+	return _bits(pixel > mean for pixel in pixels)
+
+
+def differenceHash(image):
+	pixels = _greyscale(image, (HASH_SIZE + 1, HASH_SIZE)).tobytes()
+	rows = (pixels[row * (HASH_SIZE + 1):(row + 1) * (HASH_SIZE + 1)] for row in range(HASH_SIZE))
+	return _bits(left > right for row in rows for left, right in zip(row, row[1:]))
+
+
+def shapeHash(image):
+	alpha = image.convert("RGBA").getchannel("A").resize((HASH_SIZE, HASH_SIZE), Image.NEAREST)
+	return _bits(value > 127 for value in alpha.tobytes())
+
+
+HASHES = {
+	"average": averageHash,
+	"difference": differenceHash,
+	"shape": shapeHash,
+}
+
+
+def hammingDistance(first, second):
+	return bin(first ^ second).count("1")
+
+
+class BKTree:
+	"""
+	metric tree over 64 bit hashes, every node is [hash, items, {distance: child}]
+
+	items added with the same hash share a node, so identical perceptual hashes come back together
+	"""
+
+	def __init__(self):
+		self.root = None
+		self.count = 0
+
+	def __len__(self):
+		return self.count
+
+	def add(self, hashValue, item):
+		self.count += 1
+		if self.root is None:
+			self.root = [hashValue, [item], {}]
+			return
+
+		node = self.root
+		while True:
+			distance = hammingDistance(hashValue, node[0])
+			if distance == 0:
+				node[1].append(item)
+				return
+			child = node[2].get(distance)
+			if child is None:
+				node[2][distance] = [hashValue, [item], {}]
+				return
+			node = child
+
+	def search(self, hashValue, max_distance):
+		# [(distance, item)] for everything within max_distance, closest first
+		found = []
+		stack = [self.root] if self.root is not None else []
+		while stack:
+			nodeHash, items, children = stack.pop()
+			distance = hammingDistance(hashValue, nodeHash)
+			if distance <= max_distance:
+				found.extend((distance, item) for item in items)
+			# triangle inequality - anything further down sits at exactly `edge` from this node
+			for edge, child in children.items():
+				if distance - max_distance <= edge <= distance + max_distance:
+					stack.append(child)
+		found.sort(key=lambda match: match[0])
+		return found
+
+
+class PerceptualIndex:
+	"""
+	BK-tree of sprite paths by perceptual hash
+
+	:arg	hash_kind: "average", "difference" or "shape", see HASHES
+	"""
+
+	def __init__(self, hash_kind="difference"):
+		self.hashImage = HASHES[hash_kind]
+		self.tree = BKTree()
+
+	def __len__(self):
+		return len(self.tree)
+
+	def hashPath(self, path):
+		with Image.open(path) as image:
+			return self.hashImage(image)
+
+	def add(self, path, item=None):
+		# item defaults to the path, could be the completed xml entry instead
+		self.tree.add(self.hashPath(path), path if item is None else item)
+
+	def addFolder(self, imageFolder):
+		# every sprite in the sheet folders under imageFolder, e.g. the renamed (completed) sprites
+		for path in iterSpriteFiles(imageFolder):
+			self.add(path)
+
+	def similar(self, path, max_distance=6):
+		# [(distance, item)] of indexed sprites which look like the one at path, closest first
+		return self.tree.search(self.hashPath(path), max_distance)
+
+
+def buildPerceptualIndex(imageFolder, hash_kind="difference"):
+	index = PerceptualIndex(hash_kind)
+	if os.path.isdir(imageFolder):
+		index.addFolder(imageFolder)
+	return index
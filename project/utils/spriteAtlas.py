@@ -0,0 +1,245 @@
+import mmap
+import os
+import struct
+
+import numpy as np
+
+"""
+Compact binary sprite atlas index, replaces the indented spritesheet.json for the sheet data
+
+spritesheet.json has to be json.load'ed in full before a single sprite can be looked up, this file is memory mapped
+and every section is a fixed width NumPy view over the mapping, so opening it is a header read and looking up a sheet
+or sprite touches only the bytes it needs.
+
+File layout (little endian, every section starts on an 8 byte boundary)
+	header - magic, version, sheet / record / group counts, string table size, hash slot count
+	sheets - SHEET_DTYPE per sheet, name offset, atlasId and the range of records on it
+	records - RECORD_DTYPE per frame, grouped by sheet then by sprite name, frames keep their original order
+	groups - GROUP_DTYPE per (sheet, sprite name), the range of records for that sprite
+	strings - utf-8 sheet and sprite names, each stored once
+	hash - open addressing table of (group + 1), 0 is empty, keyed on FNV-1a of "sheet\\0sprite"
+
+Sprite positions are stored as x, y, w, h (the json used x, y, h, w)
+"""
+
+ATLAS_MAGIC = b"RMSA"
+ATLAS_VERSION = 1
+HEADER = struct.Struct("<4sHHIIIII4x")
+
+SHEET_DTYPE = np.dtype([
+	("name", "<u4"),
+	("nameLength", "<u4"),
+	("atlasId", "<u8"),
+	("first", "<u4"),
+	("count", "<u4"),
+])
+
+RECORD_DTYPE = np.dtype([
+	("sheet", "<u4"),
+	("name", "<u4"),
+	("nameLength", "<u2"),
+	("transparent", "u1"),
+	("reserved", "u1"),
+	("index", "<i4"),
+	("x", "<f4"),
+	("y", "<f4"),
+	("w", "<f4"),
+	("h", "<f4"),
+	("mask", "<f4", (4,)),
+])
+
+GROUP_DTYPE = np.dtype([
+	("sheet", "<u4"),
+	("name", "<u4"),
+	("nameLength", "<u4"),
+	("first", "<u4"),
+	("count", "<u4"),
+])
+
+
+def _align(size):
+	return (size + 7) & ~7
+
+
+def _hashKey(sheet_name, sprite_name):
+	# 32 bit FNV-1a, small and easy to reproduce outside python if the web side ever reads this file directly
+	value = 0x811C9DC5
+	for byte in sheet_name.encode("utf-8") + b"\0" + sprite_name.encode("utf-8"):
+		value = ((value ^ byte) * 0x01000193) & 0xFFFFFFFF
+	return value
+
+
+class _StringTable:
+	def __init__(self):
+		self.data = bytearray()
+		self.offsets = {}
+
+	def add(self, text):
+		# returns (offset, length) of text, each distinct string is stored once
+		encoded = text.encode("utf-8")
+		if encoded not in self.offsets:
+			self.offsets[encoded] = len(self.data)
+			self.data += encoded
+		return self.offsets[encoded], len(encoded)
+
+
+def writeSpriteAtlas(atlas_path, sheet_names, sheet_atlas_ids, sprites, names):
+	"""
+	writes the binary atlas index
+
+	:arg	sheet_names / sheet_atlas_ids: per sheet, indexed by sprites["sheet"]
+	:arg	sprites: structured array with sheet, index, x, y, w, h, mask (x, y, w, h) and transparent fields, e.g. the
+	SPRITE_DTYPE arrays from xspriteArrays, already filtered down to what should be exported
+	:arg	names: sprite name per entry in sprites
+	"""
+	strings = _StringTable()
+	sheetOf = np.asarray(sprites["sheet"], dtype=np.int64)
+
+	# group id per sprite, in order of first appearance so the sprite order on each sheet matches the json
+	groupIds = {}
+	groupOf = np.array(
+		[groupIds.setdefault(key, len(groupIds)) for key in zip(sheetOf.tolist(), names)], dtype=np.int64)
+	groupKeys = list(groupIds)
+
+	# records by sheet, then group, frames in their original order
+	order = np.lexsort((np.arange(len(sprites)), groupOf, sheetOf))
+	sortedGroups = groupOf[order]
+
+	# groups in the same order as their records
+	groupOrder = sorted(range(len(groupKeys)), key=lambda group: (groupKeys[group][0], group))
+	counts = np.bincount(groupOf, minlength=len(groupKeys))[groupOrder]
+	firsts = np.concatenate(([0], np.cumsum(counts)[:-1])) if len(groupOrder) else counts
+
+	groups = np.zeros(len(groupOrder), dtype=GROUP_DTYPE)
+	nameOffsets = np.zeros(len(groupKeys), dtype=np.int64)
+	nameLengths = np.zeros(len(groupKeys), dtype=np.int64)
+	for row, group in enumerate(groupOrder):
+		sheet, name = groupKeys[group]
+		nameOffsets[group], nameLengths[group] = strings.add(name)
+		groups[row] = (sheet, nameOffsets[group], nameLengths[group], firsts[row], counts[row])
+
+	records = np.zeros(len(sprites), dtype=RECORD_DTYPE)
+	for field in ("sheet", "index", "x", "y", "w", "h", "mask", "transparent"):
+		records[field] = sprites[field][order]
+	records["name"] = nameOffsets[sortedGroups]
+	records["nameLength"] = nameLengths[sortedGroups]
+
+	sheets = np.zeros(len(sheet_names), dtype=SHEET_DTYPE)
+	for sheet, (sheet_name, atlas_id) in enumerate(zip(sheet_names, sheet_atlas_ids)):
+		offset, length = strings.add(sheet_name)
+		start, end = np.searchsorted(records["sheet"], [sheet, sheet + 1])
+		sheets[sheet] = (offset, length, atlas_id, start, end - start)
+
+	# hash table at most half full so probes stay short
+	slotCount = 8
+	while slotCount < 2 * len(groups):
+		slotCount *= 2
+	slots = np.zeros(slotCount, dtype="<u4")
+	for row, group in enumerate(groupOrder):
+		sheet, name = groupKeys[group]
+		slot = _hashKey(sheet_names[sheet], name) & (slotCount - 1)
+		while slots[slot]:
+			slot = (slot + 1) & (slotCount - 1)
+		slots[slot] = row + 1
+
+	sections = [sheets.tobytes(), records.tobytes(), groups.tobytes(), bytes(strings.data), slots.tobytes()]
+	# written to a temp file and renamed over the old one, an interrupted run leaves the previous index intact
+	tempPath = f"{atlas_path}.tmp"
+	with open(tempPath, "wb") as atlasFile:
+		atlasFile.write(HEADER.pack(
+			ATLAS_MAGIC, ATLAS_VERSION, 0, len(sheets), len(records), len(groups), len(strings.data), slotCount,
+		))
+		for section in sections:
+			atlasFile.write(section)
+			atlasFile.write(b"\0" * (_align(len(section)) - len(section)))
+	os.replace(tempPath, atlas_path)
+
+
+class SpriteAtlas:
+	"""
+	read side of the binary atlas index, every section is a view over the memory mapped file
+
+	:var	sheets / records / groups: SHEET_DTYPE / RECORD_DTYPE / GROUP_DTYPE arrays
+	"""
+
+	def __init__(self, atlas_path):
+		with open(atlas_path, "rb") as atlasFile:
+			self._map = mmap.mmap(atlasFile.fileno(), 0, access=mmap.ACCESS_READ)
+
+		magic, version, _, sheetCount, recordCount, groupCount, stringsSize, slotCount = HEADER.unpack_from(self._map)
+		if magic != ATLAS_MAGIC:
+			raise ValueError(f"{atlas_path} is not a sprite atlas index")
+		if version != ATLAS_VERSION:
+			raise ValueError(f"{atlas_path} is atlas version {version}, expected {ATLAS_VERSION}, rebuild it")
+
+		offset = HEADER.size
+		self.sheets = np.frombuffer(self._map, dtype=SHEET_DTYPE, count=sheetCount, offset=offset)
+		offset += _align(self.sheets.nbytes)
+		self.records = np.frombuffer(self._map, dtype=RECORD_DTYPE, count=recordCount, offset=offset)
+		offset += _align(self.records.nbytes)
+		self.groups = np.frombuffer(self._map, dtype=GROUP_DTYPE, count=groupCount, offset=offset)
+		offset += _align(self.groups.nbytes)
+		self._strings = memoryview(self._map)[offset:offset + stringsSize]
+		offset += _align(stringsSize)
+		self._slots = np.frombuffer(self._map, dtype="<u4", count=slotCount, offset=offset)
+
+		# sheet name -> sheet number, only built if a sheet is looked up by name
+		self._sheetNumbers = None
+
+	def _string(self, offset, length):
+		return bytes(self._strings[offset:offset + length]).decode("utf-8")
+
+	def __len__(self):
+		return len(self.records)
+
+	def sheetName(self, sheet):
+		return self._string(int(self.sheets[sheet]["name"]), int(self.sheets[sheet]["nameLength"]))
+
+	def sheetNames(self):
+		return [self.sheetName(sheet) for sheet in range(len(self.sheets))]
+
+	def spriteName(self, record):
+		# name of a record (or group) row
+		return self._string(int(record["name"]), int(record["nameLength"]))
+
+	def sheetNumber(self, sheet_name):
+		if self._sheetNumbers is None:
+			self._sheetNumbers = {name: sheet for sheet, name in enumerate(self.sheetNames())}
+		return self._sheetNumbers.get(sheet_name)
+
+	def atlasId(self, sheet_name):
+		sheet = self.sheetNumber(sheet_name)
+		return None if sheet is None else int(self.sheets[sheet]["atlasId"])
+
+	def sheet(self, sheet_name):
+		# every record on a sheet, empty if the sheet isn't in the atlas
+		sheet = self.sheetNumber(sheet_name)
+		if sheet is None:
+			return self.records[:0]
+		first = int(self.sheets[sheet]["first"])
+		return self.records[first:first + int(self.sheets[sheet]["count"])]
+
+	def frames(self, sheet_name, sprite_name):
+		# every frame of one sprite, found through the hash index without touching any other sprite
+		mask = len(self._slots) - 1
+		slot = _hashKey(sheet_name, sprite_name) & mask
+		encodedSheet = sheet_name.encode("utf-8")
+		encodedSprite = sprite_name.encode("utf-8")
+
+		while self._slots[slot]:
+			group = self.groups[int(self._slots[slot]) - 1]
+			sheet = self.sheets[int(group["sheet"])]
+			if (self._strings[int(group["name"]):int(group["name"]) + int(group["nameLength"])] == encodedSprite
+					and self._strings[int(sheet["name"]):int(sheet["name"]) + int(sheet["nameLength"])] == encodedSheet):
+				first = int(group["first"])
+				return self.records[first:first + int(group["count"])]
+			slot = (slot + 1) & mask
+
+		return self.records[:0]
+
+	def iterSprites(self):
+		# yields (sheet name, sprite name, frames) for every sprite in file order
+		sheetNames = self.sheetNames()
+		for group in self.groups:
+			first = int(group["first"])
+			yield sheetNames[int(group["sheet"])], self.spriteName(group), self.records[first:first + int(group["count"])]
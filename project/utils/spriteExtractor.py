@@ -1,43 +1,316 @@
-import json
+import hashlib
+import marshal
 import os
+import struct
+import time
+from collections import namedtuple
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import shared_memory
+
+import numpy as np
 from PIL import Image
 
-def extractSprites(json_path, spritesheet_path, output_dir):
-    # load JSON
-    with open(json_path, "r") as f:
-        data = json.load(f)
+from RotMGCalc.project.utils.spriteAtlas import SpriteAtlas
+
+"""
+Crops every sprite in the atlas index out of the game's atlas pngs
+
+Each sheet in the index records the atlasId of the png it lives on (mapObjects, characters ...), frames are grouped by
+that id and each png is opened exactly once, cropped from, and closed again before the next one is opened, so only one
+large png is ever decoded in memory at a time.
+
+PNG encoding is what takes the time here, so with more than one worker the decoded RGBA sheet is copied once into a
+shared memory block, every worker process maps that same block and crops / saves its share of the frames. Nothing but
+the block name and the frame list is sent to the workers.
+
+Extraction is incremental, a manifest in the output folder records every frame's sheet, sprite name, index, crop box,
+the hash of the atlas png it came from, a hash of its pixels and the size / mtime of the file written. On the next run
+a frame is skipped if its box and atlas png hash are unchanged and its file is still the one that was written, and an
+atlas png is only decoded at all if something on it needs writing. If the png did change, frames whose pixels are the
+same are still skipped, so a patch touching a few sprites rewrites a few files. Frames a patch removed or renamed have
+their old files deleted and drop out of the manifest, so nothing downstream keeps hashing sprites that no longer exist.
+
+iterSprites is the same walk without the files, it yields every crop as an Image (or raw RGBA bytes) along with its
+metadata so hashing / dedup / packing can use the sprites directly instead of writing, listing and reopening them.
+"""
+
+# binary atlas index written by xspriteMapping.py
+SPRITE_ATLAS = os.environ.get("SPRITE_ATLAS")
+# atlas pngs extracted from the game by atlasId, as "id=path" pairs - for example "2=mapObjects.png,1=characters.png"
+SPRITE_ATLAS_PNGS = os.environ.get("SPRITE_ATLAS_PNGS", "")
+# png used for any atlasId not in SPRITE_ATLAS_PNGS, for example mapObjects.png
+SPRITE_SHEET_PNG = os.environ.get("SPRITE_SHEET_PNG")
+OUTPUT_SPRITES = os.environ.get("OUTPUT_SPRITES", "output_sprites")
+# worker processes used to crop and save, 1 does everything in this process
+EXTRACT_WORKERS = int(os.environ.get("EXTRACT_WORKERS", os.cpu_count() or 1))
+# 0 re-extracts everything regardless of the manifest
+EXTRACT_INCREMENTAL = os.environ.get("EXTRACT_INCREMENTAL", "1") != "0"
+
+# manifest file, kept in the output folder - magic, version, marshal version then a marshal dict
+MANIFEST_NAME = ".extract_manifest.bin"
+MANIFEST_MAGIC = b"RMEM"
+MANIFEST_VERSION = 1
+MANIFEST_HEADER = struct.Struct("<4sHH")
+
+# one frame to crop, path is where it is saved
+FrameJob = namedtuple("FrameJob", ("path", "box", "sheet", "sprite", "index"))
+# one cropped frame from iterSprites, pixels is an RGBA Image or raw RGBA bytes of size[0] * size[1] * 4
+Sprite = namedtuple("Sprite", ("sheet", "sprite", "index", "atlasId", "box", "size", "pixels"))
+
+# the sheet each worker crops from, set by _attachSheet
+_workerSheet = None
+_workerMemory = None
+
+
+def parseAtlasPngs(atlas_pngs):
+	# "2=mapObjects.png,1=characters.png" -> {2: "mapObjects.png", 1: "characters.png"}
+	paths = {}
+	for pair in atlas_pngs.split(","):
+		if "=" in pair:
+			atlas_id, path = pair.split("=", 1)
+			paths[int(atlas_id)] = path.strip()
+	return paths
+
+
+def atlasFrames(atlas):
+	# atlasId -> [(sheet name, sprite name, index, crop box)] for every frame in the atlas
+	frames = {}
+	for sheet_name, sprite_name, records in atlas.iterSprites():
+		sheetFrames = frames.setdefault(atlas.atlasId(sheet_name), [])
+		for frame in records:
+			x, y, w, h = (float(frame[field]) for field in ("x", "y", "w", "h"))
+			box = (int(x), int(y), int(x + w), int(y + h))
+			sheetFrames.append((sheet_name, sprite_name, int(frame["index"]), box))
+	return frames
+
+
+def frameJobs(atlas, output_dir):
+	"""
+	FrameJob for every frame in the atlas grouped by atlasId, sheet folders are created as they are reached
+	"""
+	jobs = {}
+	for atlas_id, frames in atlasFrames(atlas).items():
+		atlasJobs = jobs[atlas_id] = []
+		for sheet_name, sprite_name, index, box in frames:
+			# create subfolder for this sheet
+			sheet_dir = os.path.join(output_dir, sheet_name)
+			os.makedirs(sheet_dir, exist_ok=True)
+
+			# build filename with index - this does not correspond to equip.xml or any other gamefiles
+			filename = f"{sprite_name}_{index}.png"
+			atlasJobs.append(FrameJob(os.path.join(sheet_dir, filename), box, sheet_name, sprite_name, index))
+	return jobs
+
+
+def fileHash(path, chunk_size=1 << 20):
+	digest = hashlib.sha256()
+	with open(path, "rb") as file:
+		for chunk in iter(lambda: file.read(chunk_size), b""):
+			digest.update(chunk)
+	return digest.digest()
+
+
+def regionHash(sheet, box):
+	return hashlib.blake2b(sheet.crop(box).tobytes(), digest_size=16).digest()
+
+
+def loadManifest(manifest_path):
+	"""
+	relative save path -> (sheet, sprite name, index, box, atlas png hash, region hash, file size, file mtime_ns)
+
+	a missing, foreign or outdated manifest is treated as empty, which just means everything is extracted again
+	"""
+	try:
+		with open(manifest_path, "rb") as manifestFile:
+			data = manifestFile.read()
+		magic, version, marshalVersion = MANIFEST_HEADER.unpack_from(data)
+		if magic == MANIFEST_MAGIC and version == MANIFEST_VERSION and marshalVersion == marshal.version:
+			return marshal.loads(memoryview(data)[MANIFEST_HEADER.size:])
+	except (OSError, EOFError, ValueError, TypeError, struct.error):
+		pass
+	return {}
+
+
+def saveManifest(manifest_path, manifest):
+	tempPath = f"{manifest_path}.tmp"
+	with open(tempPath, "wb") as manifestFile:
+		manifestFile.write(MANIFEST_HEADER.pack(MANIFEST_MAGIC, MANIFEST_VERSION, marshal.version))
+		manifestFile.write(marshal.dumps(manifest))
+	os.replace(tempPath, manifest_path)
+
+
+def _outputUnchanged(path, entry):
+	# is the file on disk still the one recorded in the manifest entry
+	try:
+		stat = os.stat(path)
+	except OSError:
+		return False
+	return stat.st_size == entry[6] and stat.st_mtime_ns == entry[7]
+
+
+def _manifestEntry(job, png_hash, region_hash):
+	stat = os.stat(job.path)
+	return job.sheet, job.sprite, job.index, job.box, png_hash, region_hash, stat.st_size, stat.st_mtime_ns
+
+
+def saveFrames(sheet, jobs):
+	# crops and saves each job from sheet, returns how many were saved
+	for job in jobs:
+		sheet.crop(job.box).save(job.path)
+	return len(jobs)
+
+
+def _attachSheet(memory_name, size):
+	global _workerSheet, _workerMemory
+	_workerMemory = shared_memory.SharedMemory(name=memory_name)
+	_workerSheet = Image.frombuffer("RGBA", size, _workerMemory.buf, "raw", "RGBA", 0, 1)
+
+
+def _saveSharedFrames(jobs):
+	return saveFrames(_workerSheet, jobs)
+
+
+def loadAtlasPng(png_path):
+	# the decoded RGBA sheet, the file itself is closed straight away
+	with Image.open(png_path) as image:
+		return image.convert("RGBA")
+
+
+def iterSprites(atlas_path, atlas_pngs, default_png=None, raw=False):
+	"""
+	yields a Sprite for every frame in the atlas, cropped in memory - nothing is written to disk
+
+	frames come grouped by atlas png, each png is decoded once and released before the next one, so only one sheet is
+	held in memory however many sprites the caller keeps
+
+	:arg	atlas_pngs / default_png: as for extractSprites, frames on an atlas with no png are left out
+	:arg	raw: yield the pixels as RGBA bytes instead of an Image
+	"""
+	frames = atlasFrames(SpriteAtlas(atlas_path))
+	for atlas_id in sorted(frames):
+		png_path = atlas_pngs.get(atlas_id, default_png)
+		if png_path is None:
+			continue
+
+		sheet = loadAtlasPng(png_path)
+		try:
+			for sheet_name, sprite_name, index, box in frames[atlas_id]:
+				crop = sheet.crop(box)
+				pixels = crop.tobytes() if raw else crop
+				yield Sprite(sheet_name, sprite_name, index, atlas_id, box, crop.size, pixels)
+		finally:
+			sheet.close()
+
+
+def extractFromSheet(sheet, jobs, workers=EXTRACT_WORKERS):
+	# crops and saves jobs from one decoded RGBA sheet, in parallel through shared memory if workers > 1
+	if workers <= 1 or len(jobs) < 2:
+		return saveFrames(sheet, jobs)
+
+	pixels = np.asarray(sheet)
+	memory = shared_memory.SharedMemory(create=True, size=pixels.nbytes)
+	try:
+		np.ndarray(pixels.shape, dtype=pixels.dtype, buffer=memory.buf)[:] = pixels
+		del pixels
+
+		# a few chunks per worker so a slow chunk doesn't hold everything up
+		chunks = [jobs[start::workers * 4] for start in range(min(len(jobs), workers * 4))]
+		with ProcessPoolExecutor(max_workers=workers, initializer=_attachSheet,
+		                         initargs=(memory.name, sheet.size)) as pool:
+			return sum(pool.map(_saveSharedFrames, chunks))
+	finally:
+		memory.close()
+		memory.unlink()
+
+
+def extractSprites(atlas_path, atlas_pngs, output_dir, workers=EXTRACT_WORKERS, default_png=None,
+                   incremental=EXTRACT_INCREMENTAL):
+	"""
+	:arg	atlas_pngs: atlasId -> png path
+	:arg	default_png: png used for atlas ids not in atlas_pngs, frames on an atlas with neither are skipped
+	:arg	incremental: skip frames the manifest shows are already extracted and unchanged
+	:return	number of sprites written
+	"""
+	# load the atlas index, this only maps the file, sprites are read as they are cropped
+	atlas = SpriteAtlas(atlas_path)
+	os.makedirs(output_dir, exist_ok=True)
+
+	manifestPath = os.path.join(output_dir, MANIFEST_NAME)
+	# the recorded manifest is always read so stale sprites get cleaned up, it is only trusted for skipping if incremental
+	recorded = loadManifest(manifestPath)
+	previous = recorded if incremental else {}
+	manifest = {}
 
-    # load the PNG spritesheet
-    sheet = Image.open(spritesheet_path).convert("RGBA")
-    os.makedirs(output_dir, exist_ok=True)
+	jobs = frameJobs(atlas, output_dir)
+	started = time.perf_counter()
+	saved = skipped = 0
 
-    for sheet_entry in data.get("spritesheets", []):
-        sheet_name = sheet_entry["name"]
+	for atlas_id in sorted(jobs):
+		png_path = atlas_pngs.get(atlas_id, default_png)
+		if png_path is None:
+			print(f"No png given for atlasId {atlas_id}, skipping {len(jobs[atlas_id])} sprites")
+			# still in the atlas, so whatever was extracted for them before is kept
+			for job in jobs[atlas_id]:
+				key = os.path.relpath(job.path, output_dir)
+				if key in recorded:
+					manifest[key] = recorded[key]
+			continue
+		pngHash = fileHash(png_path)
 
-        # create subfolder for this sheet
-        sheet_dir = os.path.join(output_dir, sheet_name)
-        os.makedirs(sheet_dir, exist_ok=True)
+		# frames whose box and png are unchanged and whose file is untouched don't need the png decoded at all
+		pending = []
+		for job in jobs[atlas_id]:
+			key = os.path.relpath(job.path, output_dir)
+			entry = previous.get(key)
+			if entry and entry[3] == job.box and entry[4] == pngHash and _outputUnchanged(job.path, entry):
+				manifest[key] = entry
+				skipped += 1
+			else:
+				pending.append((key, job, entry))
+		if not pending:
+			continue
 
-        for sprite_entry in sheet_entry["sprites"]:
-            sprite_name = sprite_entry["name"]
+		sheet = loadAtlasPng(png_path)
+		try:
+			# the png changed, but most frames on it usually haven't - compare the pixels before writing
+			toSave = []
+			regionHashes = {}
+			for key, job, entry in pending:
+				regionHashes[key] = regionHash(sheet, job.box)
+				if entry and entry[3] == job.box and entry[5] == regionHashes[key] and _outputUnchanged(job.path, entry):
+					manifest[key] = _manifestEntry(job, pngHash, regionHashes[key])
+					skipped += 1
+				else:
+					toSave.append((key, job))
 
-            for frame in sprite_entry["spriteLocation"]:
-                x, y, w, h = frame["position"]
+			saved += extractFromSheet(sheet, [job for _, job in toSave], workers)
+			for key, job in toSave:
+				manifest[key] = _manifestEntry(job, pngHash, regionHashes[key])
+		finally:
+			sheet.close()
 
-                box = (int(x), int(y), int(x + w), int(y + h))
-                cropped = sheet.crop(box)
+	# sprites a patch removed or renamed are no longer in the atlas, their old files go with their manifest entries
+	removed = 0
+	for key in recorded.keys() - manifest.keys():
+		try:
+			os.remove(os.path.join(output_dir, key))
+			removed += 1
+		except FileNotFoundError:
+			pass
 
-                # build filename with index - this does not correspond to equip.xml or any other gamefiles
-                index = frame.get("index", 0)
-                filename = f"{sprite_name}_{index}.png"
-                save_path = os.path.join(sheet_dir, filename)
+	saveManifest(manifestPath, manifest)
 
-                cropped.save(save_path)
-                print(f"Saved {save_path}")
+	elapsed = time.perf_counter() - started
+	rate = saved / elapsed if elapsed else float(saved)
+	print(f"Saved {saved} sprites to {output_dir}, {skipped} unchanged, {removed} removed, in {elapsed:.2f}s "
+	      f"({rate:.0f} sprites/sec, {max(workers, 1)} workers)")
+	return saved
 
 
-extractSprites(
-    json_path="spritesheet.json",
-    spritesheet_path=r"C:\Code\RotMGCalc\localfiles\spritesheets\mapObjects.png", # TODO env variable
-    output_dir="output_sprites"
-)
\ No newline at end of file
+if __name__ == '__main__':
+	extractSprites(
+		atlas_path=SPRITE_ATLAS,
+		atlas_pngs=parseAtlasPngs(SPRITE_ATLAS_PNGS),
+		output_dir=OUTPUT_SPRITES,
+		default_png=SPRITE_SHEET_PNG
+	)
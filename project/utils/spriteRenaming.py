@@ -7,7 +7,11 @@ from tkinter import messagebox
 from tkinter import font
 from PIL import Image, ImageTk
 
-from RotMGCalc.project.utils.unusedSpriteToBinary import computeHash, SKIP_ARCHIVE
+from RotMGCalc.project.utils.unusedSpriteToBinary import (
+	computeFileHash, computeHash, isSpriteFile, iterDigests, iterSpriteFiles, HashCache, SKIP_ARCHIVE,
+)
+from RotMGCalc.project.utils.xmlStreaming import iterObjects
+from RotMGCalc.project.itemdatabase import parseTypeId
 
 """
 This file is to be used on the unnamed images extracted from the sprite sheets to make manually renaming the 
@@ -32,6 +36,14 @@ labels_required = {"ARMOR", "WEAPON", "RING", "ABILITY"}
 FINISHED_SPRITES = 'spriteRenameComplete.xml'
 
 
+def typeKey(type):
+	# "0xA14" and "0xa14" -> the same int, anything that isn't a type id (the DUMMY_TYPE placeholder) stays a string
+	try:
+		return parseTypeId(type)
+	except ValueError:
+		return type
+
+
 def spriteSheetReader(input_xml, ignore_labels=False):
 	"""
 	reads an XML with the required data and returns a compact version of that for parsing
@@ -41,52 +53,22 @@ def spriteSheetReader(input_xml, ignore_labels=False):
 	this is also used to read the spriteRenameComplete.xml file which will be used to verify what has already
 	been done, so I can pick up from where I left off
 
+	the XML is streamed through iterObjects rather than parsed whole, so only the compact records are kept in memory
+
 	:returns: ID (Item name), Type (Item ID), File (SpriteSheet item is on), Display ID, Description, and Labels packed
 	as a nested dictionaries in a list (results).
 	Item count per sprite sheet as a dictionary (file_count)
 	"""
-	tree = ET.parse(input_xml)
-	ET_Root = tree.getroot()
-
 	results = []
 	file_count = {}
 
-	for obj in ET_Root.findall(".//Object"):
-		# get the required attributes to verify sprites, honestly its a lot but deca does not name things aptly
-
-		# the "or" is required so it reads my complete sprites xml
-		type = obj.get("type") or obj.findtext("Type")
-		id = obj.get("id") or obj.findtext("Id")
-		labels = obj.findtext("Labels")
-		display_id = obj.findtext("DisplayId")
-		description = obj.findtext("Description")
-		file = obj.findtext(".//Texture/File") or obj.findtext("File")
-		# used for caching images of the sprites, so that they can be skipped in future runs
-		imageHash = obj.findtext(".//Texture/ImageHash")
-
-		# skip entries missing labels or file
-		if not labels or not file:
-			continue
-
-		label_list = {lbl.strip().upper() for lbl in labels.split(",") if lbl.strip()}
-
-		if not ignore_labels and not (label_list & labels_required):
-			continue
-
+	for entry in iterObjects(input_xml, None if ignore_labels else labels_required):
 		try:
-			file_count[file] += 1
+			file_count[entry["File"]] += 1
 		except KeyError:
-			file_count.update({file: 1})
-
-		results.append({
-			"Id": id,
-			"Type": type,
-			"Labels": list(label_list),
-			"DisplayID": display_id,
-			"Description": description,
-			"File": file,
-			"ImageHash": imageHash,
-		})
+			file_count.update({entry["File"]: 1})
+
+		results.append(entry)
 	# sort by file so it matches folder order
 	results.sort(key=lambda x: x["File"].lower())
 	return results, file_count
@@ -109,7 +91,64 @@ def saveCurrentProgress(sprite_entry, xml_entry):
 
 	root.append(obj)
 
-	tree.write(FINISHED_SPRITES, encoding="utf-8", xml_declaration=True)
+	writeFinishedTree(tree, FINISHED_SPRITES)
+
+
+def writeFinishedTree(finished_tree, finished_path):
+	# written to a temp file first so a crash mid write can't take the completed work with it
+	tempPath = f"{finished_path}.tmp"
+	finished_tree.write(tempPath, encoding="utf-8", xml_declaration=True)
+	os.replace(tempPath, finished_path)
+
+
+def migrateImageHashes(finished_tree, finished_path, renamed_sprites_root, parsed_sprites_root):
+	"""
+	one off rewrite of the ImageHash values in spriteRenameComplete.xml from file hashes to pixel hashes
+
+	each completed object's renamed copy (<renamed root>/<File>/<type>.png) is hashed, anything without one is matched
+	against the file hashes of the parsed sprites instead. the file is only rewritten and marked hashFormat="pixel" once
+	every entry has been converted, otherwise it's left alone and tried again on the next launch. the all zero
+	placeholder hash isn't a sprite so it's left out
+
+	:return	set of hashes in the file still in the old file hash format, empty once migrated
+	"""
+	finishedRoot = finished_tree.getroot()
+	if finishedRoot.get("hashFormat") == "pixel":
+		return set()
+
+	legacyHashes = set()
+	converted = []
+	unresolved = {}
+	for obj in finishedRoot.iter("Object"):
+		imageHash = obj.find("ImageHash")
+		if imageHash is None or not imageHash.text or not imageHash.text.strip("0"):
+			continue
+		legacyHashes.add(imageHash.text)
+		renamedPath = os.path.join(renamed_sprites_root or "", obj.findtext("File") or "", f"{obj.get('type')}.png")
+		if renamed_sprites_root and os.path.isfile(renamedPath):
+			converted.append((imageHash, computeHash(renamedPath)))
+		else:
+			unresolved.setdefault(imageHash.text, []).append(imageHash)
+
+	# only read the parsed sprites if something is left to match
+	if unresolved:
+		if not parsed_sprites_root or not os.path.isdir(parsed_sprites_root):
+			return legacyHashes
+		for spritePath in iterSpriteFiles(parsed_sprites_root):
+			for imageHash in unresolved.pop(computeFileHash(spritePath), ()):
+				converted.append((imageHash, computeHash(spritePath)))
+			if not unresolved:
+				break
+		if unresolved:
+			print(f"{len(unresolved)} completed sprites couldn't be converted to pixel hashes, leaving the file as is")
+			return legacyHashes
+
+	# the tree is only touched once everything converted, saveCurrentProgress writes this same tree later
+	for imageHash, pixelHash in converted:
+		imageHash.text = pixelHash
+	finishedRoot.set("hashFormat", "pixel")
+	writeFinishedTree(finished_tree, finished_path)
+	return set()
 
 
 def spriteRenamer(sprite_entry, xml_entry):
@@ -143,7 +182,8 @@ def equipmentImageParsing(parsed_sprites_root, renamed_sprites_root, sprite_coun
 	"""
 
 	spriteCountPerSheet = sprite_count_per_sheet
-	parsedSpritesRoot = os.listdir(parsed_sprites_root)
+	with os.scandir(parsed_sprites_root) as entries:
+		parsedSpritesRoot = [entry.name for entry in entries if entry.is_dir()]
 
 	# check if the destination directories exist, if not, create them
 	for originalFolder in parsedSpritesRoot:
@@ -151,11 +191,12 @@ def equipmentImageParsing(parsed_sprites_root, renamed_sprites_root, sprite_coun
 		if not os.path.exists(dest_path):
 			os.mkdir(dest_path)
 
-	# iterate through sprite folders
-
+	# list every sprite folder first so all of the images can be hashed in one go on the thread pool
+	sprites = []
 	for spriteFolders in parsedSpritesRoot:
 		spriteFolderPath = os.path.join(parsed_sprites_root, spriteFolders)
-		files = os.listdir(spriteFolderPath)
+		with os.scandir(spriteFolderPath) as entries:
+			files = [entry.path for entry in entries if isSpriteFile(entry)]
 		# files available on the disk
 		fileCount = len(files)
 		# expected file count, as per the equip.xml data
@@ -171,18 +212,23 @@ def equipmentImageParsing(parsed_sprites_root, renamed_sprites_root, sprite_coun
 		# destination rename folder
 		renamedSpriteFolder = os.path.join(renamed_sprites_root, spriteFolders)
 
-		for spriteImage in files:
-			spriteImagePath = os.path.join(spriteFolderPath, spriteImage)
-			spriteImageHash = computeHash(spriteImagePath)
-
-			yield {
+		for spriteImagePath in files:
+			sprites.append({
 				"status": fileStatus,
 				"spritePath": spriteImagePath,
 				"destinationRenamePath": renamedSpriteFolder,
 				"fileCount": fileCount,
 				"equipObjectsFileCount": equipObjectsFileCount,
-				"imageHash": spriteImageHash,
-			}
+			})
+
+	# hashes come back in the same order as the paths, sprites unchanged since the last launch come from the cache
+	hashCache = HashCache()
+	digests = [digest for _, digest in iterDigests((entry["spritePath"] for entry in sprites), cache=hashCache)]
+	hashCache.save()
+
+	for sprite, spriteImageDigest in zip(sprites, digests):
+		sprite["imageHash"] = spriteImageDigest.hex()
+		yield sprite
 
 
 def imagePreview(path, size=(0, 0)):
@@ -401,6 +447,8 @@ class ReviewSession:
 		self.completedEquipmentObjects = []
 		self.completedHashes = {}
 		self.completedTypes = {}
+		# completed hashes still in the old file hash format, only checked while the migration is unfinished
+		self.legacyHashes = set()
 		self.equipmentObjects = []
 		self.spriteCountPerSheet = {}
 
@@ -413,28 +461,40 @@ class ReviewSession:
 			e["ImageHash"]: e for e in self.completedEquipmentObjects
 		}
 
-		# this will store the "type" for each equipment item which has been completed
+		# this will store the "type" for each equipment item which has been completed, as an int so "0xA14" and
+		# "0xa14" are the same item
 		self.completedTypes = {
-			e["Type"] for e in self.completedEquipmentObjects
+			typeKey(e["Type"]) for e in self.completedEquipmentObjects if e["Type"]
 		}
 
+	def isTypeCompleted(self, type):
+		return bool(type) and typeKey(type) in self.completedTypes
+
+	def isImageCompleted(self, image_entry):
+		if image_entry["imageHash"] in self.completedHashes:
+			return True
+		return bool(self.legacyHashes) and computeFileHash(image_entry["spritePath"]) in self.legacyHashes
+
 
 class InitialiseApp:
 	def __init__(self, master):
 		self.master = master
 		master.title("Sprite Renaming")
 		self.reviewSession = ReviewSession()
+		# completed sprites saved before pixel hashing have file hashes, this rewrites them once
+		legacyHashes = migrateImageHashes(tree, FINISHED_SPRITES, BASE_RENAMED_SPRITES_DIR, PARSED_OUTPUT_SPRITES)
 		self.reviewSession.load_XML_Sources(INPUT_XML, FINISHED_SPRITES)
+		self.reviewSession.legacyHashes = legacyHashes
 
 		self.equipImages = list(equipmentImageParsing(PARSED_OUTPUT_SPRITES, BASE_RENAMED_SPRITES_DIR,
 		                                              self.reviewSession.spriteCountPerSheet))
 		self.incompleteEquipImages = [
 			e for e in self.equipImages
-			if e["imageHash"] not in self.reviewSession.completedHashes
+			if not self.reviewSession.isImageCompleted(e)
 		]
 		self.incompleteEquipmentData = [
 			e for e in self.reviewSession.equipmentObjects
-			if e["Type"] not in self.reviewSession.completedTypes
+			if not self.reviewSession.isTypeCompleted(e["Type"])
 		]
 		self.completedRenamesData = []
 		self.undoStack = self.reviewSession.completedEquipmentObjects[:10:-1]
@@ -508,7 +568,7 @@ if __name__ == '__main__':
 		tree = ET.parse(FINISHED_SPRITES)
 		root = tree.getroot()
 	else:
-		root = ET.Element("Objects")
+		root = ET.Element("Objects", {"hashFormat": "pixel"})
 		tree = ET.ElementTree(root)
 
 	App_root = tkinter.Tk()
@@ -1,9 +1,20 @@
+import bisect
 import hashlib
+import marshal
+import mmap
 import os
+import struct
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
 from unittest.util import three_way_cmp
 
+from PIL import Image
 from PIL.ImageChops import difference
 
+from RotMGCalc.project.utils.spriteExtractor import (
+	SPRITE_ATLAS, SPRITE_ATLAS_PNGS, SPRITE_SHEET_PNG, iterSprites, parseAtlasPngs,
+)
+
 """
 This tool compares all the extracted sprites to my manually filtered list of equipment sprites and encodes them as a
 sha256 hash, this hash can be utilised for future filtering of required equipment sprites.
@@ -18,91 +29,399 @@ for this situation
 Original Sprite Count - 13973
 Manually Parsed Sprite Count - 2407
 Final Sprite Count - ... 
+
+Skip archive layout (little endian)
+	header - magic, version, digest size, digest count
+	fanout - 256 uint32, fanout[b] is how many digests have a first byte <= b
+	digests - raw 32 byte sha256 digests, sorted and unique
+
+the archive is memory mapped rather than loaded, a membership check is a fanout lookup to narrow it down to the
+digests sharing the first byte then a binary search over those, so there is no load step however big it gets.
+
+Updates never append, mergeSkipArchive writes the merged archive to a temp file and renames it over the old one, so a
+crash mid update leaves the previous archive intact and the file only ever holds each digest once.
+
+Hashing 14000+ sprites is all file reads and png decoding, zlib and hashlib both drop the GIL while they work so
+iterDigests spreads the files over a thread pool in batches and streams (path, digest) back in order as each batch
+finishes.
+
+Most sprites don't change between runs, so a HashCache (hashcache.bin) remembers each file's digest against its
+(absolute path, size, mtime_ns) - a file whose stat still matches is never read again, so relaunching the renaming
+tool or re-running the skip update only hashes what actually changed.
+
+The hash is over the decoded pixels, not the png file - (width, height) then the raw RGBA bytes. The same sprite saved
+with different png settings or metadata (a new extractor, re-saving it in an editor) keeps its hash, hashing the file
+bytes would give it a new one and it would fall out of the skip archive and the completed list. computeFileHash is the
+old file hash, only kept so spriteRenaming.migrateImageHashes can convert entries saved before the switch.
+
+Because the hash only depends on the pixels, the full extracted set doesn't have to come from the output folder at all,
+iterSpriteDigests hashes the crops spriteExtractor.iterSprites makes in memory and gives the same digests as hashing
+the saved pngs. updateSkipBinary does that when SPRITE_ATLAS is set, so building the skip archive never lists or
+reopens the 14000+ extracted files.
 """
 
 
 SKIP_ARCHIVE = "skiparchive.bin"
+SKIP_MAGIC = b"RMSK"
+# 2 - digests are pixel hashes
+SKIP_VERSION = 2
+DIGEST_SIZE = 32
+SKIP_HEADER = struct.Struct("<4sHHI")
+FANOUT = struct.Struct("<256I")
 ORIGINAL_OUTPUT_FOLDER = os.environ.get("ORIGINAL_SPRITES")
 PARSED_OUTPUT_FOLDER = os.environ.get("PARSED_OUTPUT_SPRITES")
+# threads used for hashing, files per batch handed to a thread and bytes read at a time from each file
+HASH_WORKERS = int(os.environ.get("HASH_WORKERS", min(32, (os.cpu_count() or 1) * 4)))
+HASH_BATCH = 64
+HASH_CHUNK = 1 << 20
+# persistent digest cache, see HashCache - kept next to this module by default so every run shares the same warm cache
+# wherever it was started from
+HASH_CACHE = os.environ.get(
+	"HASH_CACHE", os.path.join(os.path.dirname(os.path.abspath(__file__)), "hashcache.bin"))
+HASH_CACHE_MAGIC = b"RMHC"
+HASH_CACHE_VERSION = 2
+HASH_CACHE_HEADER = struct.Struct("<4sHH")
+
+
+def rgbaDigest(size, rgba):
+	# raw 32 byte sha256 of (width, height) then the RGBA bytes, the size is included so a 8x16 and a 16x8 sprite
+	# can't collide
+	digest = hashlib.sha256(struct.pack("<II", *size))
+	digest.update(rgba)
+	return digest.digest()
+
+
+def imageDigest(image):
+	# pixel hash of a PIL image
+	if image.mode != "RGBA":
+		image = image.convert("RGBA")
+	return rgbaDigest(image.size, image.tobytes())
+
+
+def iterSpriteDigests(sprites):
+	"""
+	yields (sprite, raw digest) for the Sprite tuples from spriteExtractor.iterSprites, either pixel form
+
+	the crops are already decoded so there is no file reading to spread over threads, this is just the hash
+	"""
+	for sprite in sprites:
+		if isinstance(sprite.pixels, bytes):
+			yield sprite, rgbaDigest(sprite.size, sprite.pixels)
+		else:
+			yield sprite, imageDigest(sprite.pixels)
+
+
+def computeDigest(imagePath):
+	# raw 32 byte pixel hash of a sprite file, this is what the skip archive stores
+	with Image.open(imagePath) as image:
+		return imageDigest(image)
 
 
 def computeHash(imagePath):
-	# return encoded hash for a sprite
+	# return encoded hash for a sprite, hex form of computeDigest as stored in the xml
+	return computeDigest(imagePath).hex()
+
+
+def computeFileHash(imagePath):
+	# hex sha256 of the file bytes, the hash used before pixel hashing
+	digest = hashlib.sha256()
 	with open(imagePath, "rb") as imageFile:
-		imageBytes = imageFile.read()
-		return hashlib.sha256(imageBytes).hexdigest()
+		for chunk in iter(lambda: imageFile.read(HASH_CHUNK), b""):
+			digest.update(chunk)
+	return digest.hexdigest()
+
 
+def isSpriteFile(entry):
+	# png files only, sheet folders can also hold things like Thumbs.db / desktop.ini which can't be decoded
+	return entry.is_file() and entry.name.lower().endswith(".png")
 
-def loadSkipBinary():
+
+def iterSpriteFiles(imageFolder):
+	# paths of every sprite in the sheet folders under imageFolder, sorted so results are stable between runs
+	with os.scandir(imageFolder) as sheetEntries:
+		sheetFolders = sorted(entry.path for entry in sheetEntries if entry.is_dir())
+	for sheetFolder in sheetFolders:
+		with os.scandir(sheetFolder) as spriteEntries:
+			yield from sorted(entry.path for entry in spriteEntries if isSpriteFile(entry))
+
+
+class HashCache:
 	"""
-	returns the binary data as a set, each 32 bytes in size. you can encode your own images which should then yield
-	the same binary data for my encoded data in the file "skiparchive.bin".
+	absolute path -> (size, mtime_ns, raw digest), persisted as a marshal dict behind a small header
+
+	a missing or outdated cache file is just an empty cache, it fills back up on the next run
 	"""
-	skipped_set = set()
-	with open(SKIP_ARCHIVE, "rb") as skipBinaryData:
-		if not skipBinaryData:
-			print("Skip Data not found")
-		while True:
-			spriteHash = skipBinaryData.read(32)
-			if not spriteHash:
-				break
-			skipped_set.add(spriteHash)
-	return skipped_set
-
-
-def saveSkipBinary(skipSet):
-	# saves the set of encoded sprite hashes to the binary file
+
+	def __init__(self, cache_path=HASH_CACHE):
+		self.cache_path = cache_path
+		self.entries = {}
+		self.changed = False
+		try:
+			with open(cache_path, "rb") as cacheFile:
+				data = cacheFile.read()
+			magic, version, marshalVersion = HASH_CACHE_HEADER.unpack_from(data)
+			if magic == HASH_CACHE_MAGIC and version == HASH_CACHE_VERSION and marshalVersion == marshal.version:
+				self.entries = marshal.loads(memoryview(data)[HASH_CACHE_HEADER.size:])
+		except (OSError, EOFError, ValueError, TypeError, struct.error):
+			pass
+
+	def __len__(self):
+		return len(self.entries)
+
+	def lookup(self, path, stat):
+		# cached digest if the file still has the size / mtime it was hashed with, otherwise None
+		entry = self.entries.get(os.path.abspath(path))
+		if entry and entry[0] == stat.st_size and entry[1] == stat.st_mtime_ns:
+			return entry[2]
+		return None
+
+	def store(self, path, stat, digest):
+		self.entries[os.path.abspath(path)] = (stat.st_size, stat.st_mtime_ns, digest)
+		self.changed = True
+
+	def save(self):
+		# write then rename, same as the skip archive, and only if something was hashed
+		if not self.changed:
+			return
+		tempPath = f"{self.cache_path}.tmp"
+		with open(tempPath, "wb") as cacheFile:
+			cacheFile.write(HASH_CACHE_HEADER.pack(HASH_CACHE_MAGIC, HASH_CACHE_VERSION, marshal.version))
+			cacheFile.write(marshal.dumps(self.entries))
+		os.replace(tempPath, self.cache_path)
+		self.changed = False
+
+
+def _digestBatch(batch):
+	# batch is [(path, stat, cached digest or None)], only the uncached ones are read
+	return [(path, stat, digest or computeDigest(path)) for path, stat, digest in batch]
+
+
+def iterDigests(paths, workers=HASH_WORKERS, cache=None):
+	"""
+	yields (path, raw digest) for every path, in the order given, hashing on a thread pool
+
+	paths can be any iterable (e.g. iterSpriteFiles), it is consumed lazily in batches with only a couple of batches
+	per thread in flight, so results start coming back before the full listing is done and memory stays flat however
+	many files there are. with a HashCache, unchanged files come straight from it and new digests are added to it,
+	saving the cache is left to the caller
+	"""
+	def batches():
+		batch = []
+		for path in paths:
+			stat = os.stat(path) if cache is not None else None
+			batch.append((path, stat, cache.lookup(path, stat) if cache is not None else None))
+			if len(batch) == HASH_BATCH:
+				yield batch
+				batch = []
+		if batch:
+			yield batch
+
+	def finish(results):
+		for path, stat, digest in results:
+			if cache is not None and cache.lookup(path, stat) != digest:
+				cache.store(path, stat, digest)
+			yield path, digest
+
+	if workers <= 1:
+		for batch in batches():
+			yield from finish(_digestBatch(batch))
+		return
+
+	# pool.map would submit every batch up front, so keep a bounded queue of futures and yield them in order
+	with ThreadPoolExecutor(max_workers=workers) as pool:
+		pending = deque()
+		for batch in batches():
+			pending.append(pool.submit(_digestBatch, batch))
+			if len(pending) >= workers * 2:
+				yield from finish(pending.popleft().result())
+		while pending:
+			yield from finish(pending.popleft().result())
+
+
+def _digestBytes(spriteHash):
+	# accepts either form, hex strings (computeHash / the xml) or raw digests
+	return bytes.fromhex(spriteHash) if isinstance(spriteHash, str) else bytes(spriteHash)
+
+
+class _DigestView:
+	# sequence of the digests in [start, end) of the mapped archive, just enough for bisect
+	def __init__(self, data, base, start, end):
+		self.data = data
+		self.base = base
+		self.start = start
+		self.end = end
+
+	def __len__(self):
+		return self.end - self.start
+
+	def __getitem__(self, index):
+		# slicing the mmap gives bytes, which compare where memoryviews don't
+		offset = self.base + (self.start + index) * DIGEST_SIZE
+		return self.data[offset:offset + DIGEST_SIZE]
+
+
+class SkipArchive:
+	"""
+	read side of skiparchive.bin, memory mapped - `digest in archive` works with raw digests or hex strings
+
+	a missing archive is just an empty one
+	"""
+
+	def __init__(self, archive_path=SKIP_ARCHIVE):
+		self._map = None
+		self._fanout = (0,) * 256
+		self._start = 0
+		self.count = 0
+
+		if not os.path.exists(archive_path) or os.path.getsize(archive_path) == 0:
+			return
+
+		with open(archive_path, "rb") as archiveFile:
+			self._map = mmap.mmap(archiveFile.fileno(), 0, access=mmap.ACCESS_READ)
+
+		magic, version, digestSize, self.count = SKIP_HEADER.unpack_from(self._map)
+		if magic != SKIP_MAGIC or version != SKIP_VERSION or digestSize != DIGEST_SIZE:
+			# unmap before raising so the caller is free to replace the file
+			self.close()
+			if magic != SKIP_MAGIC:
+				raise ValueError(f"{archive_path} is not a skip archive")
+			raise ValueError(f"{archive_path} is skip archive version {version}, expected {SKIP_VERSION}, rebuild it")
+
+		self._fanout = FANOUT.unpack_from(self._map, SKIP_HEADER.size)
+		self._start = SKIP_HEADER.size + FANOUT.size
+
+	def __len__(self):
+		return self.count
+
+	def __contains__(self, spriteHash):
+		digest = _digestBytes(spriteHash)
+		if len(digest) != DIGEST_SIZE:
+			return False
+		first = digest[0]
+		start = self._fanout[first - 1] if first else 0
+		view = _DigestView(self._map or b"", self._start, start, self._fanout[first])
+		index = bisect.bisect_left(view, digest)
+		return index < len(view) and view[index] == digest
+
+	def __iter__(self):
+		# raw digests in sorted order
+		for offset in range(self._start, self._start + self.count * DIGEST_SIZE, DIGEST_SIZE):
+			yield self._map[offset:offset + DIGEST_SIZE]
+
+	def close(self):
+		if self._map is not None:
+			self._map.close()
+			self._map = None
+
+
+def writeSkipArchive(archive_path, digests):
+	# writes digests (raw or hex) as a sorted, duplicate free archive, replacing whatever was there in one rename
+	ordered = sorted({_digestBytes(spriteHash) for spriteHash in digests})
+	fanout = [0] * 256
+	for digest in ordered:
+		fanout[digest[0]] += 1
+	for byte in range(1, 256):
+		fanout[byte] += fanout[byte - 1]
+
+	tempPath = f"{archive_path}.tmp"
+	with open(tempPath, "wb") as archiveFile:
+		archiveFile.write(SKIP_HEADER.pack(SKIP_MAGIC, SKIP_VERSION, DIGEST_SIZE, len(ordered)))
+		archiveFile.write(FANOUT.pack(*fanout))
+		archiveFile.write(b"".join(ordered))
+		archiveFile.flush()
+		os.fsync(archiveFile.fileno())
+	os.replace(tempPath, archive_path)
+
+
+def mergeSkipArchive(archive_path, added=(), removed=()):
+	"""
+	adds and removes digests (raw or hex) from the archive in a single write then rename
+
+	:return	(added, removed) - how many digests were actually new / actually dropped, re-adding what is already there
+	counts for nothing so repeated runs over the same sprites leave the archive as it is
+	"""
+	try:
+		skipArchive = SkipArchive(archive_path)
+	except ValueError as error:
+		# an archive from before pixel hashing can't be merged into, its digests are file hashes
+		print(f"{error}, starting a new one")
+		current = set()
+	else:
+		current = set(skipArchive)
+		# the mapping has to go before the rename, windows won't replace a mapped file
+		skipArchive.close()
+
+	removedSet = {_digestBytes(spriteHash) for spriteHash in removed}
+	addedSet = {_digestBytes(spriteHash) for spriteHash in added} - removedSet
+	addedCount = len(addedSet - current)
+	removedCount = len(current & removedSet)
+
+	if addedCount or removedCount or not os.path.exists(archive_path):
+		current |= addedSet
+		current -= removedSet
+		writeSkipArchive(archive_path, current)
+	return addedCount, removedCount
+
+
+def loadSkipBinary(archive_path=SKIP_ARCHIVE):
+	"""
+	returns the skip archive, mapped rather than read so this is instant whatever its size. membership works with the
+	raw 32 byte digests or with computeHash hex strings. you can encode your own images which should then yield the
+	same binary data for my encoded data in the file "skiparchive.bin".
+	"""
+	skipArchive = SkipArchive(archive_path)
+	if not len(skipArchive):
+		print("Skip Data not found")
+	return skipArchive
+
+
+def saveSkipBinary(skipSet, archive_path=SKIP_ARCHIVE):
+	# saves the set of encoded sprite hashes to the binary file, sorted and without duplicates
 	print("Saving skip binary...")
-	with open(SKIP_ARCHIVE, "ab") as skipBinaryData:
-		for spriteHash in skipSet:
-			skipBinaryData.write(spriteHash)
+	writeSkipArchive(archive_path, skipSet)
+
 
+def returnHashedImages(imageFolder, cache=None):
+	# digests of every sprite in every sheet folder under imageFolder
+	return {digest for _, digest in iterDigests(iterSpriteFiles(imageFolder), cache=cache)}
 
-def returnHashedImages(imageFolder):
-	hashedSprites = set()
 
-	hashedSpritesRoot = os.listdir(imageFolder)
-	for originalSpriteFolders in hashedSpritesRoot:
-		# do the same thing as the above, but for the full sprite list
-		throwawaySprites = [
-			os.path.join(imageFolder, originalSpriteFolders, sprite)
-			for sprite in os.listdir(os.path.join(imageFolder, originalSpriteFolders))
-		]
-		hashedSprites.update(
-			computeHash(os.path.abspath(sprite)) for sprite in throwawaySprites
-		)
-	return hashedSprites
+def returnAtlasHashes(atlas_path, atlas_pngs, default_png=None):
+	# digests of every sprite in the atlas, cropped and hashed in memory without touching the extracted files
+	return {digest for _, digest in iterSpriteDigests(iterSprites(atlas_path, atlas_pngs, default_png, raw=True))}
 
 
-def updateSkipBinary(originalFolder, parsedFolder):
+def updateSkipBinary(originalFolder, parsedFolder, atlas_path=None, atlas_pngs=None, default_png=None):
 	"""
 	Updates the binary as needed
 
 	:arg	originalFolder: Directory of all extracted sprites
 	:arg    parsedFolder: Directory of manually parsed sprites
+	:arg	atlas_path / atlas_pngs / default_png: if given the extracted sprites are hashed straight from the atlas (as
+	spriteExtractor.extractSprites takes them) and originalFolder isn't read
 	"""
 	# TODO - RENAME THIS TO THE PARSED FOLDER, AS IT CURRENTLY POINTS TO THE NON-RENAMED SPRITES
-	hashedSprites = returnHashedImages(parsedFolder)
-	throwawayHashedSprites = returnHashedImages(originalFolder)
+	hashCache = HashCache()
+	hashedSprites = returnHashedImages(parsedFolder, hashCache)
+	if atlas_path:
+		throwawayHashedSprites = returnAtlasHashes(atlas_path, atlas_pngs or {}, default_png)
+	else:
+		throwawayHashedSprites = returnHashedImages(originalFolder, hashCache)
+	hashCache.save()
 
 	# compute the final throwaway binary set
 	# TODO - MY OUTPUT IS NOT COMPLETE, ONCE THE SPRITES ARE MANUALLY PARSED IT WILL BE USABLE, THIS IS FOR TESTING
 	throwawayHashedSprites.difference_update(hashedSprites)
 
-	skipBinary = loadSkipBinary()
-
-	if len(skipBinary) > 1:
-		print("Binary file found, saving the difference")
-		skipBinary.difference_update(throwawayHashedSprites)
-		saveSkipBinary(skipBinary)
-		return
-	else:
-		print("Binary file not found")
-		saveSkipBinary(throwawayHashedSprites)
+	# everything already skipped plus the new throwaways, minus anything which has since been kept
+	print("Saving skip binary...")
+	added, removed = mergeSkipArchive(SKIP_ARCHIVE, throwawayHashedSprites, hashedSprites)
+	print(f"Skip binary updated, {added} hashes added, {removed} removed")
+	return added, removed
 
 
 def checkIfSkip(imagePath, skipBinary):
-	imageHash = computeHash(imagePath)
+	imageHash = computeDigest(imagePath)
 	if imageHash in skipBinary:
 		return True
 	else:
@@ -112,7 +431,12 @@ def checkIfSkip(imagePath, skipBinary):
 if __name__ == "__main__":
 	# if there is a binary, load it
 	# skippedSet = loadSkipBinary()
-	updateSkipBinary(ORIGINAL_OUTPUT_FOLDER, PARSED_OUTPUT_FOLDER)
+	updateSkipBinary(
+		ORIGINAL_OUTPUT_FOLDER, PARSED_OUTPUT_FOLDER,
+		atlas_path=SPRITE_ATLAS,
+		atlas_pngs=parseAtlasPngs(SPRITE_ATLAS_PNGS),
+		default_png=SPRITE_SHEET_PNG,
+	)
 
 
 
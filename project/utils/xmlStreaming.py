@@ -0,0 +1,84 @@
+import xml.etree.ElementTree as ET
+
+"""
+Streaming readers for the game XML files (Equip.xml, Players.xml, Enchantments.xml)
+
+ET.parse holds the entire document in memory before a single <Object> can be looked at, for Equip.xml that is a
+few seconds and a lot of memory on every run. These readers use iterparse instead, each element is handed over once
+it has been fully read and is cleared straight after, so peak memory stays flat no matter how big the game XML gets.
+"""
+
+
+def iterElements(input_xml, tag):
+	"""
+	yields every <tag> element in the XML once its closing tag has been read
+
+	the element (and everything read before it) is cleared once the caller moves on, so anything needed from it has
+	to be pulled out before the next iteration. nested <tag> elements are only yielded as part of their outer element
+	"""
+	context = ET.iterparse(input_xml, events=("start", "end"))
+	_, root = next(context)
+	depth = 0
+
+	for event, elem in context:
+		if elem.tag != tag:
+			continue
+
+		if event == "start":
+			depth += 1
+			continue
+
+		depth -= 1
+		if depth:
+			continue
+
+		yield elem
+
+		# drop the element and detach it from the root so the tree never grows
+		elem.clear()
+		root.clear()
+
+
+def parseLabels(labels):
+	# comma separated label text to an upper case set, empty entries are dropped
+	if not labels:
+		return set()
+	return {lbl.strip().upper() for lbl in labels.split(",") if lbl.strip()}
+
+
+def iterObjects(input_xml, labels_required=None):
+	"""
+	streams the <Object> entries of an XML as compact records
+
+	this works with both equip.xml and my spriteRenameComplete.xml, the latter stores Type, Id and File as child
+	elements rather than attributes / textures
+
+	:arg	input_xml: path (or file object) of the XML to read
+	:arg	labels_required: set of labels, objects without at least one of them are skipped. None reads everything
+
+	:returns: ID (Item name), Type (Item ID), File (SpriteSheet item is on), Display ID, Description, Labels and
+	ImageHash as a dictionary per object. Entries missing labels or a file are skipped
+	"""
+	for obj in iterElements(input_xml, "Object"):
+		labels = obj.findtext("Labels")
+		file = obj.findtext(".//Texture/File") or obj.findtext("File")
+
+		# skip entries missing labels or file
+		if not labels or not file:
+			continue
+
+		label_list = parseLabels(labels)
+
+		if labels_required is not None and not (label_list & labels_required):
+			continue
+
+		yield {
+			"Id": obj.get("id") or obj.findtext("Id"),
+			"Type": obj.get("type") or obj.findtext("Type"),
+			"Labels": list(label_list),
+			"DisplayID": obj.findtext("DisplayId"),
+			"Description": obj.findtext("Description"),
+			"File": file,
+			# used for caching images of the sprites, so that they can be skipped in future runs
+			"ImageHash": obj.findtext(".//Texture/ImageHash") or obj.findtext("ImageHash"),
+		}